@@ -0,0 +1,235 @@
+from collections import defaultdict
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from card_rules import CardPattern
+from rule_variants import RuleTables
+
+# 非王牌的大小值：4=3 ... 3=15，下标 0..12
+MIN_VALUE = 3
+RANK_COUNT = 13
+FOUR_INDEX = CardPattern.get_card_value('4') - MIN_VALUE
+ACE_INDEX = CardPattern.get_card_value('A') - MIN_VALUE
+MIN_DRAGON = 3  # 龙、双龙最少三个连续点数
+MAX_JOKER_GROUP = 4  # 四王是王牌能组成的最大牌型
+
+INF = float('inf')
+
+Counts = Tuple[int, ...]
+# 正在延伸的龙/双龙按已有长度分组计数：(长度1, 长度2, 长度>=3) 各有几条
+Runs = Tuple[int, int, int]
+# 在某个点数上的决策：(继续延伸的长龙数, 继续延伸的长双龙数, 新起的龙数, 新起的双龙数)
+Choice = Tuple[int, int, int, int]
+Plan = Tuple[float, int, int, Tuple[Choice, ...]]
+# 拆牌时能用的组合牌型：(火箭, 龙, 双龙)；玩法里关掉的不参与拆牌
+Shape = Tuple[bool, bool, bool]
+FULL_SHAPE: Shape = (True, True, True)
+
+# 预先算好的拆牌结果（rules_snapshot.install 设置），查不到时返回 None，再现算
+_shared_plans: Optional[Callable[[Counts], Optional[Plan]]] = None
+
+
+def rank_counts(hand: List[str]) -> Tuple[Counts, int]:
+    """手牌按点数统计张数，返回 (13 个点数的张数, 王的张数)"""
+    counts = [0] * RANK_COUNT
+    jokers = 0
+    for card in hand:
+        if '王' in card:
+            jokers += 1
+        else:
+            counts[CardPattern.get_card_value(card) - MIN_VALUE] += 1
+    return tuple(counts), jokers
+
+
+def _solve(counts: Counts, dragons: bool = True, doubles: bool = True,
+           bound: Tuple[float, int] = (INF, 0)) -> Tuple[float, int, List[Choice]]:
+    """从小到大逐个点数决策的动态规划，返回 (最少手数, 单张数, 每个点数的决策)
+
+    状态是 (正在延伸的龙, 正在延伸的双龙)，逐个点数向后推进，每个状态只留 (手数, 单张数) 最小的走法。
+    龙长度达到 3 以后具体长度不影响后续决策；长龙的条数也只在不超过本点数可用张数时才有区别，
+    多出来的只能结束（结束不花手数），合并后每个点数只有几十个状态；
+    短龙相同、长龙更多而 (手数, 单张数) 不更多的状态不会更差，被压住的状态也丢掉。
+    同一点数剩下的牌（不在龙里的）总是合成一组：任意张数的同点数牌都是合法牌型。
+    手数和单张数只增不减，走到一半就超过 bound 的走法直接丢掉；没有不超过 bound 的拆法时手数为 INF。
+    """
+    n = len(counts)
+    # 每个点数之前的状态 -> (手数, 单张数, 前一个状态, 本点数的决策)
+    layer: Dict[Tuple[int, ...], Tuple[int, int, Any, Optional[Choice]]] = {(0, 0, 0, 0, 0, 0): (0, 0, None, None)}
+    layers = []
+    for i in range(n):
+        c = counts[i]
+        can_start = n - i >= MIN_DRAGON
+        next1 = counts[i + 1] if i + 1 < n else 0
+        next2 = counts[i + 2] if i + 2 < n else 0
+        following: Dict[Tuple[int, ...], Tuple[int, int, Any, Optional[Choice]]] = {}
+        for state, (plays0, singles0, _, _) in layer.items():
+            a1, a2, a3, b1, b2, b3 = state
+            forced = a1 + a2 + 2 * (b1 + b2)  # 长度不足 3 的龙必须继续
+            for ca in range(a3 + 1):
+                for cb in range(b3 + 1):
+                    used = forced + ca + 2 * cb
+                    if used > c:
+                        break
+                    # 剪枝：结束一条龙又在紧接着的点数新起一条，不如把两条连成一条，省一手
+                    for n2 in range((c - used) // 2 + 1 if doubles and can_start and cb == b3 else 1):
+                        for n1 in range(c - used - 2 * n2 + 1 if dragons and can_start and ca == a3 else 1):
+                            # 剪枝：后两个点数的牌不够让短龙继续延伸
+                            forced_next = n1 + a1 + 2 * (n2 + b1)
+                            if forced_next > next1 or n1 + 2 * n2 > next2:
+                                break
+                            left = c - used - 2 * n2 - n1
+                            # 剪枝：还有剩牌时，把它接到本可以结束的龙上不会多出一手，
+                            # 除非剩下的正好是一对（接一张到龙上）或三张（接两张到双龙上），那样会多出一个单张
+                            if (ca < a3 and left >= 1 and left != 2) or (cb < b3 and left >= 2 and left != 3):
+                                continue
+                            plays = plays0 + n1 + n2 + (1 if left else 0)
+                            singles = singles0 + (1 if left == 1 else 0)
+                            if (plays, singles) > bound:
+                                continue
+                            # 下一个点数上最多 free 条长龙能继续，条数超过的状态都等价
+                            free = next1 - forced_next
+                            long1 = a2 + ca if a2 + ca < free else free
+                            long2 = b2 + cb if 2 * (b2 + cb) < free else free // 2
+                            key = (n1, a1, long1, n2, b1, long2)
+                            old = following.get(key)
+                            if old is None or (plays, singles) < (old[0], old[1]):
+                                following[key] = (plays, singles, state, (ca, cb, n1, n2))
+        # 剪枝：短龙一样时，长龙不少、(手数, 单张数) 也不多的状态不会更差，被它压住的状态丢掉
+        same_short: Dict[Tuple[int, ...], list] = defaultdict(list)
+        for key, entry in following.items():
+            same_short[key[0], key[1], key[3], key[4]].append((key, entry[0], entry[1]))
+        for group in same_short.values():
+            if len(group) > 1:
+                for key, plays, singles in group:
+                    for other, other_plays, other_singles in group:
+                        if (other is not key and other[2] >= key[2] and other[5] >= key[5]
+                                and (other_plays, other_singles) <= (plays, singles)
+                                and (other[2], other[5], other_plays, other_singles) != (key[2], key[5], plays, singles)):
+                            del following[key]
+                            break
+        layers.append(following)
+        layer = following
+    # 所有龙都必须至少三个点数
+    finals = [(entry[0], entry[1], state) for state, entry in layer.items()
+              if state[0] == state[1] == state[3] == state[4] == 0]
+    if not finals:
+        return INF, 0, []
+    plays, singles, state = min(finals, key=lambda f: (f[0], f[1]))
+    # 沿着前一个状态倒推，记录每个点数的决策
+    choices: List[Choice] = []
+    for following in reversed(layers):
+        _, _, state, choice = following[state]
+        choices.append(choice)
+    choices.reverse()
+    return plays, singles, choices
+
+
+@lru_cache(maxsize=1 << 12)
+def _plan(counts: Counts, shape: Shape = FULL_SHAPE) -> Plan:
+    """枚举火箭个数，返回 (最少手数, 单张数, 火箭数, 每个点数的决策)"""
+    if _shared_plans is not None and shape == FULL_SHAPE:  # 共享表只有标准牌型的拆法
+        shared = _shared_plans(counts)
+        if shared is not None:
+            return shared
+    return solve_plan(counts, shape)
+
+
+def solve_plan(counts: Counts, shape: Shape = FULL_SHAPE) -> Plan:
+    """不查共享表，直接计算 _plan 的结果（生成规则快照时用）"""
+    rockets, dragons, doubles = shape
+    best: Plan = (INF, 0, 0, ())
+    for k in range(min(counts[FOUR_INDEX] // 2, counts[ACE_INDEX]) + 1 if rockets else 1):
+        rest = list(counts)
+        rest[FOUR_INDEX] -= 2 * k
+        rest[ACE_INDEX] -= k
+        # 已有的最优拆法作为上界，火箭数不同的各次求解只需找更好的
+        plays, singles, choices = _solve(tuple(rest), dragons, doubles, (best[0] - k, best[1]))
+        if (plays + k, singles) < best[:2]:
+            best = (plays + k, singles, k, tuple(choices))
+    return best
+
+
+def share_plans(source: Optional[Callable[[Counts], Optional[Plan]]]) -> None:
+    global _shared_plans
+    _shared_plans = source
+    _plan.cache_clear()
+
+
+def min_plays(hand: List[str]) -> int:
+    """手牌最少需要出几手"""
+    counts, jokers = rank_counts(hand)
+    return int(_plan(counts)[0]) + -(-jokers // MAX_JOKER_GROUP)
+
+
+def plan_shape(rules: Optional[RuleTables]) -> Shape:
+    return FULL_SHAPE if rules is None else (rules.rocket, rules.dragon, rules.double_dragon)
+
+
+def arrange_groups(hand: List[str], rules: Optional[RuleTables] = None) -> List[List[str]]:
+    """把手牌拆成出牌手数最少的牌组（炸弹、炮、龙、双龙、对子、单张、王、火箭）
+
+    牌组按最小点数从小到大排列，王和火箭放在最后（与 deal_cards 中火箭的位置一致）。
+    给出 rules 时只用该玩法开着的牌型：关掉的火箭、龙、双龙不参与拆牌，
+    关掉的同点数牌型和王牌型再拆成更小的合法牌组（这时不一定是最少手数）。
+    """
+    by_index: Dict[int, List[str]] = defaultdict(list)
+    jokers: List[str] = []
+    for card in CardPattern.sort_cards(hand):
+        if '王' in card:
+            jokers.append(card)
+        else:
+            by_index[CardPattern.get_card_value(card) - MIN_VALUE].append(card)
+
+    def take(index: int, k: int) -> List[str]:
+        cards = by_index[index][:k]
+        del by_index[index][:k]
+        return cards
+
+    counts, _ = rank_counts(hand)
+    _, _, rocket_count, choices = _plan(counts, plan_shape(rules))
+    rockets = [take(FOUR_INDEX, 2) + take(ACE_INDEX, 1) for _ in range(rocket_count)]
+
+    # 按动态规划的决策逐个点数重建具体的龙和双龙
+    groups: List[List[str]] = []
+    dragons: List[List[str]] = []  # 正在延伸的龙
+    doubles: List[List[str]] = []  # 正在延伸的双龙
+    for i, (ca, cb, n1, n2) in enumerate(choices):
+        # 长度已够的龙里，不继续的就此结束
+        # 多副牌时两条龙的牌可能完全相同，按对象而不是按内容移除
+        ended = [run for run in dragons if len(run) >= MIN_DRAGON][ca:]
+        ended += [run for run in doubles if len(run) >= 2 * MIN_DRAGON][cb:]
+        if ended:
+            groups.extend(ended)
+            ended_ids = {id(run) for run in ended}
+            dragons = [run for run in dragons if id(run) not in ended_ids]
+            doubles = [run for run in doubles if id(run) not in ended_ids]
+        for run in dragons:
+            run.extend(take(i, 1))
+        for run in doubles:
+            run.extend(take(i, 2))
+        dragons.extend(take(i, 1) for _ in range(n1))
+        doubles.extend(take(i, 2) for _ in range(n2))
+        if by_index[i]:
+            groups.append(take(i, len(by_index[i])))
+    groups.extend(dragons + doubles)
+    groups.sort(key=lambda g: (CardPattern.get_card_value(g[0]), -len(g)))
+
+    # 王：最多四张一组
+    for i in range(0, len(jokers), MAX_JOKER_GROUP):
+        groups.append(jokers[i:i + MAX_JOKER_GROUP])
+    groups += rockets
+    if rules is None or rules.standard:
+        return groups
+    return [part for group in groups for part in _split_invalid(group, rules)]
+
+
+def _split_invalid(group: List[str], rules: RuleTables) -> List[List[str]]:
+    """把玩法里不合法的同点数牌组或王拆成几组合法的，每次取最长的合法前缀（单张总是合法的）"""
+    parts = []
+    while group:
+        k = len(group)
+        while k > 1 and rules.pattern_of(group[:k])[0] == CardPattern.PATTERN_INVALID:
+            k -= 1
+        parts.append(group[:k])
+        group = group[k:]
+    return parts
@@ -0,0 +1,77 @@
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from typing import Any, Callable, List
+
+from bot import SimSeat, greedy_move, pending_decision
+from hand_index import clear_caches
+from server import GameRoom
+
+
+def idle_room(_: int) -> GameRoom:
+    """刚创建、只有房主在等待的房间"""
+    room = GameRoom(1)
+    room.add_player(SimSeat(0))
+    return room
+
+
+def active_room(moves: int) -> Callable[[int], GameRoom]:
+    """6 人 2 副牌、已经出了 moves 手的房间"""
+    def build(_: int) -> GameRoom:
+        room = GameRoom(2)
+        for i in range(6):
+            room.add_player(SimSeat(i))
+        room.start_game()
+        for _ in range(moves):
+            seat = next((p for p in room.players if pending_decision(room, p)), None)
+            if seat is None:
+                break
+            kind, cards = greedy_move(room, seat)
+            if kind == 'play':
+                room.handle_play(seat, list(cards))
+            else:
+                room.handle_pass(seat)
+        return room
+    return build
+
+
+def bytes_per_room(build: Callable[[int], Any], count: int) -> float:
+    """tracemalloc 统计 count 个房间存活时的平均占用"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    rooms: List[Any] = [build(i) for i in range(count)]
+    # 牌型判断的缓存是进程级的（有上限），不算在房间里
+    clear_caches()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rooms
+    return (after - before) / count
+
+
+def broadcast_cost(repeat: int) -> float:
+    """6 人房间一次 broadcast_game_state 的耗时（微秒）"""
+    room = active_room(10)(0)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        room.broadcast_game_state()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="房间内存占用基准")
+    parser.add_argument('--rooms', type=int, default=2000)
+    parser.add_argument('--moves', type=int, default=10)
+    args = parser.parse_args()
+    random.seed(0)
+
+    # 先建一个房间，让缓存和模块级对象在统计之前分配好
+    active_room(args.moves)(0)
+    idle = bytes_per_room(idle_room, args.rooms)
+    active = bytes_per_room(active_room(args.moves), args.rooms // 10)
+    print(f"空闲房间: {idle:8.0f} 字节/间  (10 万间约 {idle * 1e5 / 2**20:.0f} MiB)")
+    print(f"6 人 2 副牌对局中: {active:8.0f} 字节/间  (10 万间约 {active * 1e5 / 2**20:.0f} MiB)")
+    print(f"broadcast_game_state: {broadcast_cost(2000):.1f} 微秒/次")
@@ -0,0 +1,436 @@
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import tornado.ioloop
+
+from arrange import arrange_groups
+from card_rules import DECK, CardPattern
+from rule_variants import RuleSpec, RuleTables, compile_rules, standard_rules
+
+logger = logging.getLogger(__name__)
+
+# 出牌动作：('play', 牌列表) 或 ('pass', [])
+Move = Tuple[str, List[str]]
+
+
+STANDARD = standard_rules()  # 没有房间时（如直接枚举出牌）使用的标准玩法
+
+# 只能打同牌型的普通牌型
+NORMAL_PATTERNS = {
+    CardPattern.PATTERN_SINGLE, CardPattern.PATTERN_PAIR,
+    CardPattern.PATTERN_DRAGON, CardPattern.PATTERN_DOUBLE_DRAGON,
+}
+
+MAX_ROLLOUT_STEPS = 600  # 单次模拟的最大动作数，防止异常状态下死循环
+MAX_CANDIDATES = 12  # 蒙特卡洛搜索考虑的候选动作数
+
+
+def full_deck(deck_count: int) -> List[str]:
+    """生成完整牌组（不洗牌）"""
+    return list(DECK) * deck_count
+
+
+def candidate_plays(hand: List[str]) -> List[List[str]]:
+    """枚举手牌中所有可能的合法牌型（每种点数组合只取一种花色搭配）"""
+    by_value: Dict[int, List[str]] = defaultdict(list)
+    jokers: List[str] = []
+    for card in hand:
+        if '王' in card:
+            jokers.append(card)
+        else:
+            by_value[CardPattern.get_card_value(card)].append(card)
+    plays: List[List[str]] = []
+
+    # 同点数的单张、对子、炮、炸弹……（最多八张）
+    for value in sorted(by_value):
+        cards = by_value[value]
+        for k in range(1, len(cards) + 1):
+            plays.append(cards[:k])
+
+    # 王：单张分大小王，多张时优先用小王
+    jokers.sort(key=lambda c: 0 if c == '小王' else 1)
+    for joker in set(jokers):
+        plays.append([joker])
+    for k in range(2, len(jokers) + 1):
+        plays.append(jokers[:k])
+
+    # 火箭（两张4和一张A）
+    fours = by_value.get(CardPattern.get_card_value('4'), [])
+    aces = by_value.get(CardPattern.get_card_value('A'), [])
+    if len(fours) >= 2 and aces:
+        plays.append(fours[:2] + aces[:1])
+        # 同花色的火箭才能打过杂色火箭
+        for ace in aces:
+            same_suit = [c for c in fours if c[0] == ace[0]]
+            if len(same_suit) >= 2:
+                plays.append(same_suit[:2] + [ace])
+                break
+
+    # 龙与双龙：按连续点数窗口枚举
+    values = sorted(by_value)
+    for need, min_len in ((1, 3), (2, 3)):
+        for i, start in enumerate(values):
+            run: List[str] = []
+            expected = start
+            for value in values[i:]:
+                if value != expected or len(by_value[value]) < need:
+                    break
+                run.extend(by_value[value][:need])
+                expected += 1
+                if expected - start >= min_len:
+                    plays.append(list(run))
+    return plays
+
+
+def legal_plays(hand: List[str], last_cards: List[str], rules: RuleTables = STANDARD) -> List[List[str]]:
+    """手牌中所有能打过上一手牌的出牌"""
+    last_pattern, last_value = rules.pattern_of(last_cards)
+    result = []
+    for play in candidate_plays(hand):
+        pattern, value = rules.pattern_of(play)
+        if pattern == CardPattern.PATTERN_INVALID:
+            continue
+        # 普通牌型只能打同牌型且更大的牌，先筛掉明显打不过的，减少 can_beat 调用
+        if pattern in NORMAL_PATTERNS and (pattern != last_pattern or value <= last_value):
+            continue
+        if rules.can_beat(play, last_cards):
+            result.append(play)
+    return result
+
+
+def pending_decision(room: Any, seat: Any) -> Optional[str]:
+    """该座位当前需要做的决策：'fork'（叉）、'hook'（勾）、'turn'（出牌或过）或 None"""
+    if not room.game_started or seat not in room.players:
+        return None
+    hand = room.seats[seat].cards
+    if room.fork_enabled:
+        if (seat != room.current_player and seat != room.hook_player and hand
+                and seat not in room.passed_players and room.can_fork(room.current_card, hand)):
+            return 'fork'
+        return None
+    if room.waiting_for_hook:
+        if seat == room.fork_player or not hand or seat in room.passed_players:
+            return None
+        # 原出牌玩家不需要表态，但如果有牌也可以勾
+        if seat == room.current_player and not CardPattern.can_hook(room.current_card, hand):
+            return None
+        return 'hook'
+    if seat == room.current_player:
+        return 'turn'
+    return None
+
+
+def _lead_key(play: List[str]) -> Tuple[int, int]:
+    return min(CardPattern.get_card_value(c) for c in play), -len(play)
+
+
+def lead_plays(hand: List[str], arrange: bool = False, rules: RuleTables = STANDARD) -> List[List[str]]:
+    """首出的候选，第一个为贪心选择：优先出包含最小牌的普通牌型，尽量多走牌
+
+    arrange=True 时先按最优拆牌取最小的普通牌组，不拆散炸弹和龙（更慢，模拟中不用）。
+    """
+    pattern_of, power_patterns = rules.pattern_of, rules.power_patterns
+    plays = [p for p in candidate_plays(hand) if pattern_of(p)[0] != CardPattern.PATTERN_INVALID]
+    normal = sorted((p for p in plays if pattern_of(p)[0] not in power_patterns), key=_lead_key)
+    power = sorted((p for p in plays if pattern_of(p)[0] in power_patterns), key=lambda p: pattern_of(p)[1])
+    if arrange:
+        groups = [g for g in arrange_groups(hand, rules) if pattern_of(g)[0] not in power_patterns]
+        if groups:
+            first = min(groups, key=_lead_key)
+            return [first] + [p for p in normal + power if sorted(p) != sorted(first)]
+    return normal + power
+
+
+def candidate_moves(room: Any, seat: Any, arrange: bool = False) -> List[Move]:
+    """当前决策下所有值得考虑的动作，第一个为贪心策略的选择"""
+    decision = pending_decision(room, seat)
+    hand = room.seats[seat].cards
+    if decision == 'fork':
+        fork_cards = [c for c in hand if c[1:] == room.current_card[1:]][:2]
+        return [('play', fork_cards), ('pass', [])]
+    if decision == 'hook':
+        hook_cards = [c for c in hand if c[1:] == room.current_card[1:]][:1]
+        if hook_cards:
+            return [('play', hook_cards), ('pass', [])]
+        return [('pass', [])]
+    if decision != 'turn':
+        return []
+    if not hand:
+        return [('pass', [])]
+
+    rules = room.rules
+    # 首出或给光状态：可以出任意牌，不能过
+    if not room.last_cards or room.is_giving_light:
+        return [('play', p) for p in lead_plays(hand, arrange, rules)[:MAX_CANDIDATES]]
+
+    # 牌型索引判断打不过时直接过，不用枚举出牌
+    if not room.can_beat_last(seat):
+        return [('pass', [])]
+    beats = legal_plays(hand, room.last_cards, rules)
+    pattern_of = rules.pattern_of
+    last_pattern, _ = pattern_of(room.last_cards)
+    same = sorted((p for p in beats if pattern_of(p)[0] == last_pattern), key=lambda p: pattern_of(p)[1])
+    power = sorted((p for p in beats if pattern_of(p)[0] != last_pattern), key=lambda p: pattern_of(p)[1])
+    moves: List[Move] = []
+    if same:
+        moves.append(('play', same[0]))
+    # 上家快出完了或者自己快出完了，才舍得用大牌
+    last_count = len(room.seats[room.last_player].cards) if room.last_player else 0
+    if power and (last_count <= 6 or len(hand) <= len(power[0]) + 3):
+        moves.append(('play', power[0]))
+    moves.append(('pass', []))
+    moves.extend(('play', p) for p in same[1:] + power if ('play', p) not in moves)
+    return moves[:MAX_CANDIDATES]
+
+
+def greedy_move(room: Any, seat: Any, arrange: bool = False) -> Optional[Move]:
+    """快速的贪心决策，用作模拟时所有玩家的策略，以及搜索超时时的兜底"""
+    moves = candidate_moves(room, seat, arrange)
+    return moves[0] if moves else None
+
+
+class SimSeat:
+    """模拟对局中的座位，代替 WebSocketHandler"""
+
+    __slots__ = ('index',)
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+
+    def write_message(self, message: Dict[str, Any]) -> None:
+        pass
+
+
+def public_snapshot(room: Any, player: Any) -> Dict[str, Any]:
+    """从房间中提取该玩家可见的信息（自己的手牌 + 公开信息），用于送到进程池"""
+    index = {p: i for i, p in enumerate(room.players)}
+
+    def seat(p: Any) -> Optional[int]:
+        return index.get(p) if p is not None else None
+
+    return {
+        'deck_count': room.deck_count,
+        'rules': room.rules.spec.to_dict(),
+        'seat': index[player],
+        'hand': list(room.seats[player].cards),
+        'card_counts': [len(room.seats[p].cards) for p in room.players],
+        'played_cards': list(room.played_cards),
+        'current_player': seat(room.current_player),
+        'last_cards': list(room.last_cards),
+        'last_player': seat(room.last_player),
+        'fork_enabled': room.fork_enabled,
+        'hook_enabled': room.hook_enabled,
+        'waiting_for_hook': room.waiting_for_hook,
+        'current_card': room.current_card,
+        'hook_player': seat(room.hook_player),
+        'fork_player': seat(room.fork_player),
+        'passed_players': [index[p] for p in room.passed_players if p in index],
+        'finished_order': [index[p] for p in room.finished_order if p in index],
+        'is_giving_light': room.is_giving_light,
+        'last_empty_player': seat(room.last_empty_player),
+    }
+
+
+def unknown_cards(snapshot: Dict[str, Any]) -> List[str]:
+    """对手手中可能的牌：完整牌组减去自己的手牌和已打出的牌"""
+    remaining = full_deck(snapshot['deck_count'])
+    for card in snapshot['hand'] + snapshot['played_cards']:
+        remaining.remove(card)
+    return remaining
+
+
+def sample_hands(snapshot: Dict[str, Any], rng: random.Random,
+                 pool: Optional[List[str]] = None) -> List[List[str]]:
+    """按照各家手牌数，随机分配未知牌，得到一组与公开信息一致的手牌"""
+    pool = list(pool if pool is not None else unknown_cards(snapshot))
+    rng.shuffle(pool)
+    hands = []
+    pos = 0
+    for i, count in enumerate(snapshot['card_counts']):
+        if i == snapshot['seat']:
+            hands.append(list(snapshot['hand']))
+        else:
+            hands.append(pool[pos:pos + count])
+            pos += count
+    return hands
+
+
+def build_room(snapshot: Dict[str, Any], hands: List[List[str]]) -> Any:
+    """用快照和手牌重建一个可以继续对局的 GameRoom"""
+    from server import GameRoom, Seat
+
+    seats = [SimSeat(i) for i in range(len(hands))]
+
+    def seat(i: Optional[int]) -> Optional[SimSeat]:
+        return seats[i] if i is not None else None
+
+    rules = compile_rules(RuleSpec.from_dict(snapshot['rules'])) if 'rules' in snapshot else None
+    room = GameRoom(snapshot['deck_count'], rules=rules)
+    room.players = seats
+    room.seats = {s: Seat(f"玩家{s.index + 1}") for s in seats}
+    for s, hand in zip(seats, hands):
+        room.seats[s].cards = list(hand)
+    room.game_started = True
+    room.current_player = seat(snapshot['current_player'])
+    room.last_cards = list(snapshot['last_cards'])
+    room.last_player = seat(snapshot['last_player'])
+    room.fork_enabled = snapshot['fork_enabled']
+    room.hook_enabled = snapshot['hook_enabled']
+    room.waiting_for_hook = snapshot['waiting_for_hook']
+    room.current_card = snapshot['current_card']
+    room.hook_player = seat(snapshot['hook_player'])
+    room.fork_player = seat(snapshot['fork_player'])
+    room.passed_players = [seats[i] for i in snapshot['passed_players']]
+    room.finished_order = [seats[i] for i in snapshot['finished_order']]
+    room.is_giving_light = snapshot['is_giving_light']
+    room.last_empty_player = seat(snapshot['last_empty_player'])
+    room.played_cards = list(snapshot['played_cards'])
+    room.index_hands()
+    return room
+
+
+def estimate_scores(room: Any) -> Dict[Any, int]:
+    """对局未能走完时，按剩余手牌数推定名次并估算得分"""
+    n = len(room.players)
+    remaining = sorted((p for p in room.players if p not in room.finished_order),
+                       key=lambda p: len(room.seats[p].cards))
+    order = list(room.finished_order) + remaining
+    scores = {p: n - i - 1 for i, p in enumerate(order[:-1])}
+    scores[order[-1]] = -len(room.seats[order[-1]].cards)
+    return scores
+
+
+def apply_move(room: Any, seat: Any, move: Move) -> bool:
+    """在模拟房间中执行一个动作，返回是否成功"""
+    kind, cards = move
+    if kind == 'play':
+        success, _ = room.play_cards(seat, list(cards))
+    else:
+        success, _ = room.pass_turn(seat)
+    return success
+
+
+def rollout(room: Any) -> Dict[Any, int]:
+    """所有玩家用贪心策略把对局打完，返回各座位得分"""
+    for _ in range(MAX_ROLLOUT_STEPS):
+        if sum(1 for p in room.players if room.seats[p].cards) <= 1:
+            room.check_game_over()
+            return {p: room.seats[p].score for p in room.players}
+        start = room.players.index(room.current_player) if room.current_player in room.players else 0
+        order = room.players[start:] + room.players[:start]
+        actor = next((p for p in order if pending_decision(room, p)), None)
+        if actor is None:
+            break
+        move = greedy_move(room, actor)
+        if move is None or not apply_move(room, actor, move):
+            break
+    return estimate_scores(room)
+
+
+def search_move(snapshot: Dict[str, Any], budget: float, seed: Optional[int] = None) -> Optional[Move]:
+    """蒙特卡洛搜索：对每个候选动作，在随机抽样的对手手牌上模拟到终局，取平均得分最高的动作
+
+    budget 为秒数，超过后立即返回当前最优动作。该函数在进程池中运行。
+    """
+    deadline = time.monotonic() + budget
+    rng = random.Random(seed)
+    pool = unknown_cards(snapshot)
+    base = build_room(snapshot, sample_hands(snapshot, rng, pool))
+    seat_index = snapshot['seat']
+    moves = candidate_moves(base, base.players[seat_index], arrange=True)
+    if len(moves) <= 1:
+        return moves[0] if moves else None
+
+    totals = [0.0] * len(moves)
+    counts = [0] * len(moves)
+    while time.monotonic() < deadline:
+        hands = sample_hands(snapshot, rng, pool)
+        for i, move in enumerate(moves):
+            if time.monotonic() >= deadline:
+                break
+            room = build_room(snapshot, hands)
+            seat = room.players[seat_index]
+            if not apply_move(room, seat, move):
+                totals[i] = float('-inf')
+                counts[i] += 1
+                continue
+            totals[i] += rollout(room)[seat]
+            counts[i] += 1
+
+    best = max(range(len(moves)),
+               key=lambda i: (totals[i] / counts[i] if counts[i] else float('-inf'), -i))
+    return moves[best] if counts[best] else moves[0]
+
+
+class BotPlayer:
+    """服务端机器人玩家，接口与 WebSocketHandler 一致（write_message），可直接加入 GameRoom"""
+
+    is_bot = True
+    __slots__ = ('room', 'think_time', 'delay', '_thinking')
+
+    def __init__(self, room: Any, think_time: float = 0.8, delay: float = 0.3) -> None:
+        self.room = room
+        self.think_time = think_time  # 每步搜索的时间预算（秒）
+        self.delay = delay  # 出牌前的停顿，避免机器人连续出牌太快
+        self._thinking: bool = False
+
+    def write_message(self, message: Dict[str, Any]) -> None:
+        # 只需要关心游戏状态变化；在广播过程中不能直接出牌，推迟到下一轮事件循环
+        if message.get('action') == 'game_state' and not self._thinking:
+            self._schedule()
+
+    def _schedule(self) -> None:
+        version = self.room.state_version
+        tornado.ioloop.IOLoop.current().call_later(self.delay, self._act, version)
+
+    async def _act(self, version: int) -> None:
+        room = self.room
+        if self._thinking or room.state_version != version or room.executor.closed:
+            return
+        if pending_decision(room, self) is None:
+            return
+        self._thinking = True
+        move = None
+        try:
+            future = room.submit_task(search_move, public_snapshot(room, self), self.think_time)
+            move = await asyncio.wait_for(future, self.think_time + 1.0)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            raise  # 房间关闭或任务被取消，不再出牌
+        except Exception as e:
+            logger.exception("机器人搜索出错: %s", e)
+        finally:
+            self._thinking = False
+        if room.executor.closed:
+            return
+        if room.state_version != version:
+            # 思考期间局面已经变了，按最新局面重新决策
+            self._schedule()
+            return
+        if move is None:
+            move = greedy_move(room, self, arrange=True)
+        if move is None or self._apply(move):
+            return
+        # 搜索给出的动作不合法时依次试当前局面的候选动作
+        for fallback in candidate_moves(room, self, arrange=True):
+            if fallback != move and self._apply(fallback):
+                return
+        hand = room.seats[self].cards
+        if pending_decision(room, self) == 'turn' and hand and (not room.last_cards or room.is_giving_light):
+            # 首出不能过：单张总能首出
+            self._apply(('play', hand[:1]))
+        else:
+            room.handle_pass(self)
+
+    def _apply(self, move: Move) -> bool:
+        kind, cards = move
+        if kind == 'play':
+            success, _ = self.room.handle_play(self, list(cards))
+        else:
+            success, _ = self.room.handle_pass(self)
+        return success
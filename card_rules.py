@@ -1,4 +1,24 @@
-from typing import List, Tuple, Optional, Dict
+import logging
+import sys
+from typing import Iterable, List, Tuple, Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+# 规则版本：改动牌型识别或大小比较时加一，旧的规则快照（rules_snapshot.py）会据此判定为过期
+RULES_VERSION = 1
+
+# 一副牌（不洗牌）。每张牌的字符串全进程只有一份，所有房间的牌堆、手牌和出牌都引用这些对象
+DECK: Tuple[str, ...] = tuple(
+    sys.intern(suit + rank)
+    for suit in ['♠', '♥', '♣', '♦']
+    for rank in ['3', '2', 'A', 'K', 'Q', 'J', '10', '9', '8', '7', '6', '5', '4']
+) + (sys.intern('大王'), sys.intern('小王'))
+_CARD_CODES: Dict[str, str] = {card: card for card in DECK}
+
+
+def intern_cards(cards: Iterable[str]) -> List[str]:
+    """把客户端发来的牌换成 DECK 中的同一个字符串对象；不认识的牌原样保留，交给规则校验"""
+    return [_CARD_CODES.get(card, card) for card in cards]
 
 class Card:
     RANKS: Dict[str, int] = {
@@ -94,7 +114,7 @@ class CardPattern:
             
         # 炮（三张相同）
         if len(cards) == 3 and len(set(values)) == 1 and not any('王' in card for card in cards):
-            print(f'values: {values}, values[0]: {values[0]}, CardPattern.get_card_value(values[0]): {CardPattern.get_card_value(values[0])}')
+            logger.debug("triple values: %s", values)
             return CardPattern.PATTERN_TRIPLE, CardPattern.get_card_value(values[0]) + 200
             
         # 对子（两张相同）
@@ -132,7 +152,6 @@ class CardPattern:
     def get_card_value(card: str) -> int:
         """获取牌的大小值"""
         if '王' in card:
-            print(f'hahaha card: {card}')
             return 17 if card == '大王' else 16
         if len(card) == 2 and card!='10':
             value = card[1:]  # 去掉花色
@@ -154,7 +173,8 @@ class CardPattern:
             
         new_pattern, new_value = CardPattern.get_pattern(new_cards)
         last_pattern, last_value = CardPattern.get_pattern(last_cards)
-        print(f"new_pattern: {new_pattern}, new_value: {new_value}, last_pattern: {last_pattern}, last_value: {last_value}")
+        logger.debug("new_pattern: %s, new_value: %s, last_pattern: %s, last_value: %s",
+                     new_pattern, new_value, last_pattern, last_value)
         
         if not new_pattern or new_pattern == CardPattern.PATTERN_INVALID:
             return False
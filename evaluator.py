@@ -0,0 +1,141 @@
+import argparse
+import asyncio
+import math
+import random
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+from bot import build_room, public_snapshot, rollout, sample_hands, unknown_cards
+from executor import PROCESS_WORKERS, get_process_pool
+
+
+def simulate_batch(snapshot: Dict[str, Any], games: int, seed: int) -> List[Tuple[int, int]]:
+    """在进程池中模拟一批对局，返回每局该座位的 (得分, 名次)，名次从 0 开始"""
+    rng = random.Random(seed)
+    seat_index = snapshot['seat']
+    n = len(snapshot['card_counts'])
+    results = []
+    pool = unknown_cards(snapshot)
+    for _ in range(games):
+        room = build_room(snapshot, sample_hands(snapshot, rng, pool))
+        if not room.played_cards:
+            # 刚发完牌：首家是抽样后拿到首出牌（标准玩法为红心4）的玩家
+            room.current_player = next((p for p in room.players if room.rules.first_card in room.seats[p].cards),
+                                       room.current_player)
+        score = rollout(room)[room.players[seat_index]]
+        # 出完牌的第 i 名得 n-i-1 分（>=1），剩牌的最后一名得分 <=0
+        position = n - 1 - score if score >= 1 else n - 1
+        results.append((score, position))
+    return results
+
+
+class _Stats:
+    """在线累计均值与方差（Welford）"""
+
+    def __init__(self, players: int) -> None:
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.positions = [0] * players
+
+    def add(self, score: int, position: int) -> None:
+        self.n += 1
+        delta = score - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (score - self.mean)
+        self.positions[position] += 1
+
+    def half_width(self, z: float) -> float:
+        if self.n < 2:
+            return float('inf')
+        return z * math.sqrt(self.m2 / (self.n - 1) / self.n)
+
+    def result(self, z: float) -> Dict[str, Any]:
+        n = max(self.n, 1)
+        distribution = [c / n for c in self.positions]
+        return {
+            'games': self.n,
+            'expected_score': self.mean,
+            'ci_half_width': self.half_width(z),
+            'expected_position': sum(i * p for i, p in enumerate(distribution)),
+            'position_distribution': distribution,
+            'first_place_prob': distribution[0],
+            'win_prob': 1 - distribution[-1],  # 除最后剩牌的一家外都算赢家
+        }
+
+
+def evaluate(snapshot: Dict[str, Any], ci_target: float = 0.1, z: float = 1.96,
+             batch_size: int = 64, min_games: int = 256, max_games: int = 20000,
+             executor: Optional[Executor] = None, seed: Optional[int] = None,
+             workers: int = PROCESS_WORKERS) -> Dict[str, Any]:
+    """估计手牌的期望得分和名次分布
+
+    按批并行提交到进程池，同时最多 workers 批在跑，期望得分的置信区间半宽小于 ci_target 后提前停止。
+    snapshot 由 bot.public_snapshot 生成，只使用该座位可见的信息。
+    """
+    executor = executor or get_process_pool()
+    rng = random.Random(seed)
+    stats = _Stats(len(snapshot['card_counts']))
+    submitted = 0
+    running: List[Future] = []
+
+    def submit() -> None:
+        nonlocal submitted
+        games = min(batch_size, max_games - submitted)
+        if games > 0:
+            running.append(executor.submit(simulate_batch, snapshot, games, rng.getrandbits(32)))
+            submitted += games
+
+    for _ in range(workers):
+        submit()
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            running.remove(future)
+            for score, position in future.result():
+                stats.add(score, position)
+        if stats.n >= min_games and stats.half_width(z) <= ci_target:
+            break
+        while len(running) < workers and submitted < max_games:
+            submit()
+    for future in running:
+        future.cancel()
+    return stats.result(z)
+
+
+async def evaluate_async(snapshot: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+    """在 IOLoop 中使用：评估本身在线程里调度，模拟在进程池中运行"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, lambda: evaluate(snapshot, **kwargs))
+
+
+async def evaluate_room(room: Any, **kwargs: Any) -> Dict[Any, Dict[str, Any]]:
+    """评估房间内每位玩家当前的手牌（用于复盘和匹配平衡）
+
+    先在调用时取好各座位的快照，之后房间怎么变化都不影响结果；评估不占用 IOLoop。
+    """
+    players = list(room.players)
+    snapshots = [public_snapshot(room, player) for player in players]
+    results = await asyncio.gather(*(evaluate_async(snapshot, **kwargs) for snapshot in snapshots))
+    return dict(zip(players, results))
+
+
+if __name__ == "__main__":
+    from bot import SimSeat
+    from server import GameRoom
+
+    parser = argparse.ArgumentParser(description="随机发一手牌并评估 0 号座位的牌力")
+    parser.add_argument('--decks', type=int, default=2)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--ci', type=float, default=0.1)
+    args = parser.parse_args()
+
+    room = GameRoom(args.decks)
+    for i in range(args.players):
+        room.add_player(SimSeat(i))
+    room.init_cards()
+    room.deal_cards()
+    room.current_player = next(p for p in room.players if room.rules.first_card in room.seats[p].cards)
+    room.game_started = True
+    print(' '.join(room.seats[room.players[0]].cards))
+    print(evaluate(public_snapshot(room, room.players[0]), ci_target=args.ci))
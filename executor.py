@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+import tornado.ioloop
+
+logger = logging.getLogger(__name__)
+
+# 进程池与线程池在首次使用时才创建，避免子进程 import 时重复拉起
+_process_pool: Optional[ProcessPoolExecutor] = None
+_thread_pool: Optional[ThreadPoolExecutor] = None
+PROCESS_WORKERS = os.cpu_count() or 1  # 全局进程池的工作进程数
+# 工作进程启动时要执行的初始化（如映射规则快照），必须在进程池创建前登记
+_worker_initializers: Dict[Callable[..., None], Tuple[Any, ...]] = {}
+
+
+def add_worker_initializer(fn: Callable[..., None], *args: Any) -> None:
+    """登记工作进程的初始化函数；fn 和参数必须可以被 pickle，同一函数只保留最后一次登记"""
+    _worker_initializers[fn] = args
+    if _process_pool is not None:
+        logger.warning("进程池已创建，%s 不会在现有工作进程中执行", fn.__qualname__)
+
+
+def _init_worker(initializers: Tuple[Tuple[Callable[..., None], Tuple[Any, ...]], ...]) -> None:
+    for fn, args in initializers:
+        fn(*args)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """获取全局进程池（CPU 密集型任务）"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS, initializer=_init_worker,
+                                            initargs=(tuple(_worker_initializers.items()),))
+    return _process_pool
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """获取全局线程池（释放 GIL 的任务或需要共享内存对象的任务）"""
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4))
+    return _thread_pool
+
+
+def shutdown_pools() -> None:
+    """关闭全局池，取消尚未开始的任务"""
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
+
+
+class RoomExecutor:
+    """房间级任务队列：同一房间的任务按提交顺序依次执行，房间结束时统一取消"""
+
+    __slots__ = ('_tail', '_pending', 'closed')
+
+    def __init__(self) -> None:
+        self._tail: Optional[asyncio.Future] = None  # 最后提交的任务
+        self._pending: Set[asyncio.Future] = set()  # 尚未完成的任务
+        self.closed: bool = False
+
+    def submit(self, fn: Callable[..., Any], *args: Any, use_process: bool = True) -> asyncio.Future:
+        """提交任务，返回可在 IOLoop 上 await 的 Future
+
+        fn 和参数在 use_process=True 时必须可以被 pickle（模块级函数）。
+        """
+        if self.closed:
+            raise RuntimeError("房间已关闭，不能再提交任务")
+        task = asyncio.ensure_future(self._run(self._tail, fn, args, use_process))
+        self._tail = task
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+    async def _run(self, previous: Optional[asyncio.Future], fn: Callable[..., Any],
+                   args: tuple, use_process: bool) -> Any:
+        # 等待前一个任务结束（无论成功、失败还是被取消），保证同房间内的执行顺序
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+        pool: Executor = get_process_pool() if use_process else get_thread_pool()
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+    def pending_count(self) -> int:
+        """未完成的任务数"""
+        return len(self._pending)
+
+    def cancel_all(self) -> None:
+        """取消该房间的所有任务；已在池中运行的任务结果会被丢弃"""
+        self.closed = True
+        for task in list(self._pending):
+            task.cancel()
+        self._pending.clear()
+        self._tail = None
+
+
+class IOLoopLagMonitor:
+    """IOLoop 延迟监控：定时回调的实际触发时间与预期的差值即为事件循环被阻塞的时间"""
+
+    def __init__(self, interval: float = 0.1, report_threshold: float = 0.05) -> None:
+        self.interval = interval  # 采样间隔（秒）
+        self.report_threshold = report_threshold  # 超过该阻塞时间才报告（秒）
+        self.samples: int = 0
+        self.total_lag: float = 0.0  # 累计阻塞时间
+        self.max_lag: float = 0.0  # 最大单次阻塞时间
+        self.last_lag: float = 0.0
+        self._expected: float = 0.0
+        self._handle: Optional[object] = None
+        self._io_loop: Optional[tornado.ioloop.IOLoop] = None
+
+    def start(self) -> None:
+        self._io_loop = tornado.ioloop.IOLoop.current()
+        self._schedule()
+
+    def stop(self) -> None:
+        if self._io_loop is not None and self._handle is not None:
+            self._io_loop.remove_timeout(self._handle)
+        self._handle = None
+
+    def _schedule(self) -> None:
+        self._expected = time.monotonic() + self.interval
+        self._handle = self._io_loop.call_later(self.interval, self._tick)
+
+    def _tick(self) -> None:
+        lag = max(0.0, time.monotonic() - self._expected)
+        self.samples += 1
+        self.last_lag = lag
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+        if lag >= self.report_threshold:
+            logger.warning("IOLoop 被阻塞 %.1fms", lag * 1000)
+        self._schedule()
+
+    def stats(self) -> dict:
+        """返回延迟统计（毫秒）"""
+        return {
+            'samples': self.samples,
+            'last_lag_ms': self.last_lag * 1000,
+            'max_lag_ms': self.max_lag * 1000,
+            'total_blocked_ms': self.total_lag * 1000,
+        }
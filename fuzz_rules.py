@@ -0,0 +1,487 @@
+import argparse
+import importlib
+import itertools
+import random
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from arrange import arrange_groups
+from bot import SimSeat, candidate_moves, pending_decision, public_snapshot
+from card_rules import DECK, CardPattern
+from hand_index import HandAnalysis, can_beat_cached, pattern_of
+from rule_variants import VARIANTS, RuleSpec, RuleTables, resolve_variant, standard_rules
+from server import GameRoom
+
+# 规则引擎的差分模糊测试：同样的输入分别交给参考实现和候选实现，任何不一致都缩小成最小反例。
+#
+#   牌型    get_pattern(牌)              随机构造的各种牌型、边界和近似牌型
+#   大小    can_beat(新牌, 上一手)
+#   手牌    hand_can_beat(手牌, 上一手)  “手里有没有能打过的牌”，参考实现穷举所有子集
+#   对局    room_factory(副数)           同一副牌、同一串动作（合法的和随机的）逐步比较结果和房间状态
+#
+# 另外检查几条与实现无关的性质（打乱顺序不影响牌型、合法牌型总能首出），并报告各实现的吞吐量。
+# 预设玩法没有独立的参考实现，单独检查：与同副数标准玩法的差别只在玩法改动的地方，
+# 理牌只拆出玩法里合法的牌组，机器人在这些玩法的对局里给出的出牌房间都接受。
+
+MAX_BRUTE_HAND = 10  # 穷举子集的手牌上限（2^10 个子集）
+MAX_GAME_STEPS = 800  # 单局最多执行的动作数，防止规则的异常状态下死循环
+LEGAL_ACTION_RATE = 0.8  # 对局中按合法动作走的比例，其余为随机（多半非法）的动作
+
+JOKERS = ('大王', '小王')
+BY_VALUE: Dict[int, List[str]] = defaultdict(list)  # 大小值 -> 一副牌中该点数的四张
+for _card in DECK:
+    if _card not in JOKERS:
+        BY_VALUE[CardPattern.get_card_value(_card)].append(_card)
+MIN_VALUE, MAX_VALUE = min(BY_VALUE), max(BY_VALUE)
+
+# 对局中的一个动作：(座位, 'play' 或 'pass', 牌)
+Action = Tuple[int, str, Tuple[str, ...]]
+
+
+def brute_hand_can_beat(hand: List[str], last_cards: List[str]) -> bool:
+    """参考实现：穷举手牌的所有子集，看有没有一手能打过 last_cards"""
+    if not last_cards:
+        return len(hand) > 0
+    seen = set()
+    for size in range(1, len(hand) + 1):
+        for combo in itertools.combinations(hand, size):
+            key = tuple(sorted(combo))
+            if key in seen:
+                continue
+            seen.add(key)
+            if CardPattern.can_beat(list(combo), last_cards):
+                return True
+    return False
+
+
+def indexed_hand_can_beat(hand: List[str], last_cards: List[str]) -> bool:
+    return HandAnalysis(hand).can_beat(last_cards)
+
+
+class CardPatternRules(RuleTables):
+    """不查表、不缓存，直接调用 CardPattern 的规则，作为对局比较的参考"""
+
+    __slots__ = ()
+
+    def __init__(self, spec: RuleSpec) -> None:
+        super().__init__(spec)
+        self.pattern = lambda cards: CardPattern.get_pattern(list(cards))
+        self.beats = lambda new, last: CardPattern.can_beat(list(new), list(last))
+
+
+def reference_room(deck_count: int) -> Any:
+    return GameRoom(deck_count, rules=CardPatternRules(RuleSpec(deck_count=deck_count)))
+
+
+STANDARD = standard_rules(2)  # 一副和两副的标准玩法只在能否连续叉勾上不同，牌型和比较表相同
+
+
+class RulesEngine:
+    """一套被比较的规则实现"""
+
+    __slots__ = ('name', 'get_pattern', 'can_beat', 'hand_can_beat', 'room_factory')
+
+    def __init__(self, name: str,
+                 get_pattern: Callable[[List[str]], Tuple[Optional[str], int]] = CardPattern.get_pattern,
+                 can_beat: Callable[[List[str], List[str]], bool] = CardPattern.can_beat,
+                 hand_can_beat: Callable[[List[str], List[str]], bool] = brute_hand_can_beat,
+                 room_factory: Callable[[int], Any] = GameRoom) -> None:
+        self.name = name
+        self.get_pattern = get_pattern
+        self.can_beat = can_beat
+        self.hand_can_beat = hand_can_beat
+        self.room_factory = room_factory
+
+
+ENGINES: Dict[str, RulesEngine] = {
+    'reference': RulesEngine('reference', room_factory=reference_room),
+    # 线上用的快速路径：编译好的标准玩法规则表和增量牌型索引
+    'compiled': RulesEngine('compiled', STANDARD.pattern_of, STANDARD.can_beat,
+                            lambda hand, last: HandAnalysis(hand).can_beat(last, STANDARD.beats)),
+    # 带缓存的 CardPattern（机器人和对局日志统计用）
+    'fast': RulesEngine('fast', pattern_of, can_beat_cached, indexed_hand_can_beat),
+}
+
+
+def load_engine(spec: str) -> RulesEngine:
+    """按名称取内置引擎，或按 "模块:属性" 导入（属性可以是 RulesEngine 或返回它的函数，默认取 ENGINE）"""
+    if spec in ENGINES:
+        return ENGINES[spec]
+    module, _, attr = spec.partition(':')
+    engine = getattr(importlib.import_module(module), attr or 'ENGINE')
+    # 作为脚本运行时本模块是 __main__，外部模块里的 RulesEngine 是另一个类，所以按属性判断
+    return engine if hasattr(engine, 'room_factory') else engine()
+
+
+def _outcome(fn: Callable[..., Any], *args: Any) -> Any:
+    """调用结果；抛出的异常也作为结果参与比较"""
+    try:
+        return fn(*args)
+    except Exception as e:  # 候选实现抛异常本身就是一种分歧
+        return f'!{type(e).__name__}: {e}'
+
+
+# ---- 输入生成 ----
+
+def random_hand(rng: random.Random, deck_count: int, size: int) -> List[str]:
+    return rng.sample(list(DECK) * deck_count, size)
+
+
+def random_play(rng: random.Random, deck_count: int) -> List[str]:
+    """按牌型构造一手牌，覆盖每个分支和边界；也有一部分随机的和“差一点”的牌"""
+    kind = rng.randrange(9)
+    if kind == 0:  # 1~8 张相同
+        value = rng.randint(MIN_VALUE, MAX_VALUE)
+        return rng.sample(BY_VALUE[value] * deck_count, rng.randint(1, 4 * deck_count))
+    if kind == 1:  # 王
+        return rng.sample(list(JOKERS) * deck_count, rng.randint(1, 2 * deck_count))
+    if kind == 2:  # 火箭，一半是同花色的
+        fours, aces = BY_VALUE[CardPattern.get_card_value('4')], BY_VALUE[CardPattern.get_card_value('A')]
+        if deck_count == 2 and rng.random() < 0.5:
+            suit = rng.choice('♠♥♣♦')
+            return [suit + '4', suit + '4', suit + 'A']
+        return rng.sample(fours * deck_count, 2) + [rng.choice(aces)]
+    if kind in (3, 4):  # 龙和双龙，长度到顶
+        need = 1 if kind == 3 else 2
+        length = rng.randint(3, MAX_VALUE - MIN_VALUE + 1)
+        start = rng.randint(MIN_VALUE, MAX_VALUE - length + 1)
+        return [c for v in range(start, start + length) for c in rng.sample(BY_VALUE[v] * deck_count, need)]
+    if kind in (5, 6):  # 在构造出的牌型上加、减或换一张
+        cards = random_play(rng, deck_count)
+        op = rng.randrange(3)
+        if op == 0 or len(cards) == 1:
+            cards.append(rng.choice(DECK))
+        elif op == 1:
+            cards.pop(rng.randrange(len(cards)))
+        else:
+            cards[rng.randrange(len(cards))] = rng.choice(DECK)
+        return cards
+    return random_hand(rng, deck_count, rng.randint(1, 8))
+
+
+# ---- 缩小反例 ----
+
+def _removals(cards: List[str]) -> List[List[str]]:
+    """删掉一个点数的全部牌（双龙删一对仍是双龙），或者删掉一张牌"""
+    ranks = {card[1:] if card not in JOKERS else card for card in cards}
+    by_rank = [[c for c in cards if (c[1:] if c not in JOKERS else c) != rank] for rank in ranks]
+    return by_rank + [cards[:i] + cards[i + 1:] for i in range(len(cards))]
+
+
+def shrink(diverges: Callable[..., bool], *lists: List[str]) -> Tuple[List[str], ...]:
+    """反复删牌，直到再删都不再分歧；第一个列表（新出的牌、手牌）不会删空"""
+    current = [list(cards) for cards in lists]
+    changed = True
+    while changed:
+        changed = False
+        for which, cards in enumerate(current):
+            for trial in _removals(cards):
+                if which == 0 and not trial:
+                    continue
+                candidate = current[:which] + [trial] + current[which + 1:]
+                if diverges(*candidate):
+                    current = candidate
+                    changed = True
+                    break
+            if changed:
+                break
+    return tuple(current)
+
+
+def shrink_actions(diverges: Callable[[List[Action]], bool], actions: List[Action]) -> List[Action]:
+    """删去与分歧无关的动作（先成段删，再逐个删）；删掉的多半是非法动作，重放时两边都只会失败"""
+    chunk = max(1, len(actions) // 2)
+    while chunk >= 1:
+        i = 0
+        while i < len(actions):
+            trial = actions[:i] + actions[i + chunk:]
+            if trial and diverges(trial):
+                actions = trial
+            else:
+                i += chunk
+        chunk //= 2
+    return actions
+
+
+# ---- 差分检查 ----
+
+class Divergence:
+    """一处不一致：检查的种类、最小反例和两边的结果"""
+
+    __slots__ = ('check', 'case', 'expected', 'actual')
+
+    def __init__(self, check: str, case: Dict[str, Any], expected: Any, actual: Any) -> None:
+        self.check = check
+        self.case = case
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self) -> str:
+        return f"[{self.check}] {self.case}\n  参考: {self.expected}\n  候选: {self.actual}"
+
+
+def check_properties(engine: RulesEngine, cards: List[str], rng: random.Random) -> Optional[str]:
+    """与实现无关的性质，返回违反的那一条"""
+    pattern = _outcome(engine.get_pattern, cards)
+    shuffled = rng.sample(cards, len(cards))
+    if _outcome(engine.get_pattern, shuffled) != pattern:
+        return f"打乱顺序后牌型不同: {shuffled}"
+    valid = isinstance(pattern, tuple) and pattern[0] not in (None, CardPattern.PATTERN_INVALID)
+    if valid and _outcome(engine.can_beat, cards, []) is not True:
+        return "合法牌型不能首出"
+    if not valid and _outcome(engine.can_beat, cards, random_play(rng, 1)) is True:
+        return "无效牌型打过了别的牌"
+    return None
+
+
+def fuzz_patterns(ref: RulesEngine, cand: RulesEngine, rng: random.Random, deck_count: int,
+                  rounds: int) -> List[Divergence]:
+    found = []
+    for _ in range(rounds):
+        new, last = random_play(rng, deck_count), random_play(rng, deck_count)
+        if rng.random() < 0.1:
+            last = []
+
+        def diverges(new: List[str], last: List[str]) -> bool:
+            return (_outcome(ref.get_pattern, new) != _outcome(cand.get_pattern, new)
+                    or _outcome(ref.can_beat, new, last) != _outcome(cand.can_beat, new, last))
+
+        if diverges(new, last):
+            new, last = shrink(diverges, new, last)
+            found.append(Divergence('pattern', {'new': new, 'last': last},
+                                    (_outcome(ref.get_pattern, new), _outcome(ref.can_beat, new, last)),
+                                    (_outcome(cand.get_pattern, new), _outcome(cand.can_beat, new, last))))
+        violation = check_properties(cand, new, rng)
+        if violation:
+            found.append(Divergence('property', {'cards': new}, None, violation))
+    return found
+
+
+def fuzz_hands(ref: RulesEngine, cand: RulesEngine, rng: random.Random, deck_count: int,
+               rounds: int) -> List[Divergence]:
+    found = []
+    for _ in range(rounds):
+        hand = random_hand(rng, deck_count, rng.randint(1, MAX_BRUTE_HAND))
+        last = random_play(rng, deck_count)
+
+        def diverges(hand: List[str], last: List[str]) -> bool:
+            return _outcome(ref.hand_can_beat, hand, last) != _outcome(cand.hand_can_beat, hand, last)
+
+        if diverges(hand, last):
+            hand, last = shrink(diverges, hand, last)
+            found.append(Divergence('hand', {'hand': hand, 'last': last},
+                                    _outcome(ref.hand_can_beat, hand, last),
+                                    _outcome(cand.hand_can_beat, hand, last)))
+    return found
+
+
+def new_game(engine: RulesEngine, deck_count: int, players: int, seed: int) -> Any:
+    """开一局：发牌用固定的种子，两个实现拿到同样的手牌"""
+    room = engine.room_factory(deck_count)
+    for i in range(players):
+        room.add_player(SimSeat(i))
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        room.start_game()
+    finally:
+        random.setstate(state)
+    return room
+
+
+def apply_action(room: Any, action: Action) -> Any:
+    """按 handle_play / handle_pass 的顺序执行动作（不广播），返回 (成功, 提示) 或异常"""
+    seat, kind, cards = action
+    player = room.players[seat]
+    if kind == 'pass':
+        return _outcome(room.pass_turn, player)
+    result = _outcome(room.play_cards, player, list(cards))
+    if isinstance(result, tuple) and result[0]:
+        _outcome(room.check_game_over)
+    return result
+
+
+def room_state(room: Any) -> Dict[str, Any]:
+    """用于比较的房间状态：公开信息加上每个座位的手牌和分数"""
+    state = public_snapshot(room, room.players[0])
+    del state['hand'], state['seat']
+    state['hands'] = [list(room.seats[p].cards) for p in room.players]
+    state['scores'] = [room.seats[p].score for p in room.players]
+    state['game_started'] = room.game_started
+    return state
+
+
+def random_action(rng: random.Random, room: Any) -> Action:
+    """多数时候按机器人的候选动作走，其余时候让随机座位出随机的牌或过"""
+    deciding = [p for p in room.players if pending_decision(room, p)]
+    if deciding and rng.random() < LEGAL_ACTION_RATE:
+        seat = rng.choice(deciding)
+        kind, cards = rng.choice(candidate_moves(room, seat))
+        return room.players.index(seat), kind, tuple(cards)
+    seat = rng.randrange(len(room.players))
+    hand = room.seats[room.players[seat]].cards
+    if not hand or rng.random() < 0.3:
+        return seat, 'pass', ()
+    return seat, 'play', tuple(rng.sample(hand, min(len(hand), rng.randint(1, 3))))
+
+
+def replay(ref: RulesEngine, cand: RulesEngine, deck_count: int, players: int, seed: int,
+           actions: List[Action]) -> Optional[Tuple[int, Any, Any]]:
+    """两边重放同一串动作，返回第一处不一致 (动作序号, 参考结果, 候选结果)"""
+    rooms = new_game(ref, deck_count, players, seed), new_game(cand, deck_count, players, seed)
+    if room_state(rooms[0]) != room_state(rooms[1]):
+        return -1, room_state(rooms[0]), room_state(rooms[1])
+    for step, action in enumerate(actions):
+        results = [(apply_action(room, action), room_state(room)) for room in rooms]
+        if results[0] != results[1]:
+            return step, results[0], results[1]
+    return None
+
+
+def fuzz_games(ref: RulesEngine, cand: RulesEngine, rng: random.Random, deck_count: int,
+               rounds: int) -> Tuple[List[Divergence], int]:
+    """随机对局；动作由参考房间生成，同时施加到候选房间。返回 (分歧, 执行的动作数)"""
+    found = []
+    total = 0
+    for _ in range(rounds):
+        players = rng.randint(2, 6)
+        seed = rng.getrandbits(32)
+        rooms = new_game(ref, deck_count, players, seed), new_game(cand, deck_count, players, seed)
+        actions: List[Action] = []
+        diverged = room_state(rooms[0]) != room_state(rooms[1])
+        while not diverged and rooms[0].game_started and len(actions) < MAX_GAME_STEPS:
+            action = random_action(rng, rooms[0])
+            actions.append(action)
+            results = [(apply_action(room, action), room_state(room)) for room in rooms]
+            diverged = results[0] != results[1]
+        total += len(actions)
+        if diverged:
+            actions = shrink_actions(
+                lambda trial: replay(ref, cand, deck_count, players, seed, trial) is not None, actions)
+            step, expected, actual = replay(ref, cand, deck_count, players, seed, actions)
+            if step >= 0:
+                # 只报告结果和不同的状态字段
+                (expected, expected_state), (actual, actual_state) = expected, actual
+                keys = [k for k in expected_state if expected_state[k] != actual_state.get(k)]
+                expected = (expected, {k: expected_state[k] for k in keys})
+                actual = (actual, {k: actual_state.get(k) for k in keys})
+            found.append(Divergence('game', {'deck_count': deck_count, 'players': players, 'seed': seed,
+                                             'actions': actions, 'step': step}, expected, actual))
+    return found, total
+
+
+# ---- 预设玩法 ----
+
+def _variant_rules_differ(rules: RuleTables, patterns: Tuple[Any, ...]) -> bool:
+    """这一对牌型的比较结果是否允许与标准玩法不同"""
+    if any(p in rules.spec.disabled for p in patterns):
+        return True
+    if patterns == (CardPattern.PATTERN_ROCKET, CardPattern.PATTERN_ROCKET):
+        return True
+    return patterns == (CardPattern.PATTERN_TRIPLE, CardPattern.PATTERN_DOUBLE_DRAGON)
+
+
+def fuzz_variants(rng: random.Random, rounds: int, games: int) -> List[Divergence]:
+    """每种预设玩法：牌型和比较与标准玩法对照，理牌结果合法，机器人的出牌能被房间接受"""
+    found = []
+    for name in VARIANTS:
+        for deck_count in (1, 2):
+            rules = resolve_variant(name, deck_count)
+            base = standard_rules(rules.deck_count)
+            case = {'variant': name, 'deck_count': rules.deck_count}
+            for _ in range(rounds):
+                new, last = random_play(rng, rules.deck_count), random_play(rng, rules.deck_count)
+                expected = base.pattern_of(new)
+                if expected[0] in rules.spec.disabled:
+                    expected = (CardPattern.PATTERN_INVALID, 0)
+                if _outcome(rules.pattern_of, new) != expected:
+                    found.append(Divergence('variant', dict(case, new=new), expected, _outcome(rules.pattern_of, new)))
+                patterns = (base.pattern_of(new)[0], base.pattern_of(last)[0])
+                if not _variant_rules_differ(rules, patterns) \
+                        and _outcome(rules.can_beat, new, last) != _outcome(base.can_beat, new, last):
+                    found.append(Divergence('variant', dict(case, new=new, last=last),
+                                            _outcome(base.can_beat, new, last), _outcome(rules.can_beat, new, last)))
+            for _ in range(max(1, rounds // 20)):
+                hand = random_hand(rng, rules.deck_count, rng.randint(1, 27))
+                groups = _outcome(arrange_groups, hand, rules)
+                bad = (groups if isinstance(groups, str) else
+                       [g for g in groups if rules.pattern_of(g)[0] == CardPattern.PATTERN_INVALID]
+                       or sorted(c for g in groups for c in g) != sorted(hand))
+                if bad:
+                    found.append(Divergence('variant', dict(case, hand=hand), '合法的理牌', groups))
+            for _ in range(games):
+                found += _variant_game(rng, rules, case)
+    return found
+
+
+def _variant_game(rng: random.Random, rules: RuleTables, case: Dict[str, Any]) -> List[Divergence]:
+    """机器人（按理牌出牌）打一局，它选出的出牌都必须成功"""
+    room = GameRoom(rules.deck_count, rules=rules)
+    for i in range(rng.randint(2, min(6, rules.max_players))):
+        room.add_player(SimSeat(i))
+    room.start_game()
+    for _ in range(MAX_GAME_STEPS):
+        deciding = [p for p in room.players if pending_decision(room, p)]
+        if not room.game_started or not deciding:
+            break
+        seat = rng.choice(deciding)
+        kind, cards = rng.choice(candidate_moves(room, seat, arrange=True)[:3])
+        result = apply_action(room, (room.players.index(seat), kind, tuple(cards)))
+        if kind == 'play' and not (isinstance(result, tuple) and result[0]):
+            return [Divergence('variant', dict(case, hand=room.seats[seat].cards, last=room.last_cards),
+                               ('play', cards), result)]
+    return []
+
+
+# ---- 吞吐量 ----
+
+def throughput(engine: RulesEngine, rng: random.Random, deck_count: int, count: int) -> Dict[str, float]:
+    """同一批输入上各操作每秒的次数（缓存类实现会受益于重复输入，这也是线上的情况）"""
+    plays = [random_play(rng, deck_count) for _ in range(count)]
+    pairs = list(zip(plays, plays[1:] + plays[:1]))
+    hands = [(random_hand(rng, deck_count, rng.randint(1, 8)), play) for play in plays[:count // 10]]
+    result = {}
+    for name, fn, cases in (('get_pattern', engine.get_pattern, [(p,) for p in plays]),
+                            ('can_beat', engine.can_beat, pairs),
+                            ('hand_can_beat', engine.hand_can_beat, hands)):
+        start = time.perf_counter()
+        for args in cases:
+            fn(*args)
+        result[name] = len(cases) / max(time.perf_counter() - start, 1e-9)
+    return result
+
+
+def run(ref: RulesEngine, cand: RulesEngine, seed: int, rounds: int, games: int) -> List[Divergence]:
+    rng = random.Random(seed)
+    found: List[Divergence] = []
+    for deck_count in (1, 2):
+        found += fuzz_patterns(ref, cand, rng, deck_count, rounds)
+        found += fuzz_hands(ref, cand, rng, deck_count, max(1, rounds // 20))
+        start = time.perf_counter()
+        divergences, actions = fuzz_games(ref, cand, rng, deck_count, games)
+        elapsed = time.perf_counter() - start
+        found += divergences
+        print(f"{deck_count} 副牌: {games} 局 {actions} 个动作, {actions / elapsed:,.0f} 动作/秒（两边合计）")
+        for engine in (ref, cand):
+            rates = throughput(engine, random.Random(seed), deck_count, rounds)
+            print(f"  {engine.name:>12}: " + ", ".join(f"{k} {v:,.0f}/秒" for k, v in rates.items()))
+    variants = fuzz_variants(rng, max(1, rounds // 10), max(1, games // 10))
+    print(f"预设玩法 {len(VARIANTS)} 种: 分歧 {len(variants)} 处")
+    return found + variants
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="规则引擎差分模糊测试")
+    parser.add_argument('--reference', default='reference', help="参考实现：内置名称或 模块:属性")
+    parser.add_argument('--candidate', default='compiled', help="候选实现：内置名称或 模块:属性")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rounds', type=int, default=20000, help="每种副数随机生成的牌型对数")
+    parser.add_argument('--games', type=int, default=200, help="每种副数的随机对局数")
+    args = parser.parse_args()
+
+    divergences = run(load_engine(args.reference), load_engine(args.candidate), args.seed, args.rounds, args.games)
+    for divergence in divergences:
+        print(divergence)
+    print(f"分歧 {len(divergences)} 处")
+    raise SystemExit(1 if divergences else 0)
@@ -0,0 +1,212 @@
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from functools import lru_cache
+from typing import IO, Iterator, List, Optional, Tuple
+
+from card_rules import DECK
+from rule_variants import RuleSpec
+
+logger = logging.getLogger(__name__)
+
+# 对局日志格式
+#
+# 文件：MAGIC，之后是一局接一局的记录，每局为 [u32 长度][正文]，一局只在结束时整体写入。
+# 正文：[副数][人数][首家座位][u16 规则长度][规则]，之后是事件：
+#   规则是房间玩法 RuleSpec.to_dict() 的 JSON（UTF-8）；该副数的标准玩法不写，长度为 0
+#   出牌/叉/勾  [类型][座位][张数][牌编号...]    牌编号是该牌在 card_rules.DECK 中的下标
+#   过          [类型][座位]
+#   结束        [类型]，之后每个座位一组 [i8 得分][名次]
+MAGIC = b'SPGL\x02'
+MAGIC_V1 = b'SPGL\x01'  # 旧格式：正文开头没有规则，都是标准玩法
+HEADER = struct.Struct('<I')
+RULES_LENGTH = struct.Struct('<H')
+RULES_START = 3 + RULES_LENGTH.size
+
+EVENT_PLAY = 1
+EVENT_FORK = 2
+EVENT_HOOK = 3
+EVENT_PASS = 4
+EVENT_END = 5
+
+ROTATE_BYTES = 256 << 20  # 单个日志文件写到这么大就换新文件
+ROTATE_SECONDS = 3600.0
+FLUSH_INTERVAL = 5.0  # 缓冲最多隔这么久写到磁盘（秒）
+
+CARD_CODE = {card: i for i, card in enumerate(DECK)}
+
+# 解码后的事件：(类型, 座位, 牌)；结束事件的座位为 -1，牌为空
+Event = Tuple[int, int, Tuple[str, ...]]
+
+
+class GameLog:
+    """对局日志写入器：进行中的对局各自在内存里记录，结束时整局交给后台写线程
+
+    写文件、换文件、刷盘都在写线程里完成，IOLoop 从不等待磁盘。
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._file: Optional[IO[bytes]] = None
+        self._opened_at = 0.0
+        self.games = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name='gamelog-writer', daemon=True)
+        self._writer.start()
+
+    def begin(self, spec: RuleSpec, players: int, first: int) -> bytearray:
+        """开始记录一局，返回该局的缓冲区"""
+        record = bytearray((spec.deck_count, players, first))
+        rules = b''
+        if spec.key() != RuleSpec(deck_count=spec.deck_count).key():
+            rules = json.dumps(spec.to_dict(), ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode()
+        record += RULES_LENGTH.pack(len(rules))
+        record += rules
+        return record
+
+    @staticmethod
+    def add_cards(record: bytearray, kind: int, seat: int, cards: List[str]) -> None:
+        record.append(kind)
+        record.append(seat)
+        record.append(len(cards))
+        record.extend(CARD_CODE[card] for card in cards)
+
+    @staticmethod
+    def add_pass(record: bytearray, seat: int) -> None:
+        record.append(EVENT_PASS)
+        record.append(seat)
+
+    def finish(self, record: bytearray, results: List[Tuple[int, int]]) -> None:
+        """一局结束：补上每个座位的 (名次, 得分) 并放进写入队列（不阻塞）"""
+        record.append(EVENT_END)
+        for position, score in results:
+            record.extend(struct.pack('<bB', max(-128, min(127, score)), position))
+        self._queue.put(HEADER.pack(len(record)) + record)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """写完队列中剩下的对局后关闭文件、停止写线程"""
+        self._queue.put(None)
+        self._writer.join(timeout)
+
+    def _write_loop(self) -> None:
+        flushed_at = time.monotonic()
+        while True:
+            try:
+                data = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                data = b''
+            if data is None:
+                break
+            if data:
+                try:
+                    self._current().write(data)
+                    self.games += 1
+                except OSError:
+                    logger.exception("写入对局日志失败，丢弃一局")
+                    self._close_file()
+            # 对局接连结束时也至少每 FLUSH_INTERVAL 刷一次盘
+            if time.monotonic() - flushed_at >= FLUSH_INTERVAL:
+                self._flush()
+                flushed_at = time.monotonic()
+        self._close_file()
+
+    def _current(self) -> IO[bytes]:
+        now = time.time()
+        if self._file is None or self._file.tell() >= ROTATE_BYTES or now - self._opened_at >= ROTATE_SECONDS:
+            self._close_file()
+            name = time.strftime('games-%Y%m%d-%H%M%S', time.localtime(now)) + f'-{os.getpid()}.log'
+            self._file = open(os.path.join(self.directory, name), 'ab', buffering=1 << 20)
+            if self._file.tell() == 0:
+                self._file.write(MAGIC)
+            self._opened_at = now
+            logger.info("对局日志写入 %s", name)
+        return self._file
+
+    def _flush(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.flush()
+            except OSError:
+                logger.exception("对局日志刷盘失败")
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                logger.exception("关闭对局日志失败")
+            self._file = None
+
+
+def iter_games(path: str, offset: int = 0) -> Iterator[Tuple[int, bytes]]:
+    """用 mmap 逐局读取日志，产出 (下一局的偏移, 本局正文)；offset 为 0 时从文件头之后开始
+
+    只把当前一局复制出来，文件再大也不会整体读入内存。
+    最后一局如果只写了一半（进程被杀）则停止，下次从同一偏移继续。
+    旧格式的文件在正文开头补上空的规则，产出的正文格式都一样。
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= len(MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic = mm[:len(MAGIC)]
+            if magic not in (MAGIC, MAGIC_V1):
+                raise ValueError(f"不是对局日志: {path}")
+            pos = max(offset, len(MAGIC))
+            while pos + HEADER.size <= size:
+                (length,) = HEADER.unpack_from(mm, pos)
+                end = pos + HEADER.size + length
+                if end > size:
+                    break
+                if magic == MAGIC:
+                    yield end, mm[pos + HEADER.size:end]
+                else:
+                    start = pos + HEADER.size
+                    yield end, mm[start:start + 3] + RULES_LENGTH.pack(0) + mm[start + 3:end]
+                pos = end
+
+
+def game_rules(game: bytes) -> RuleSpec:
+    """一局所用的玩法"""
+    (length,) = RULES_LENGTH.unpack_from(game, 3)
+    return _decode_rules(game[0], bytes(game[RULES_START:RULES_START + length]))
+
+
+@lru_cache(maxsize=256)
+def _decode_rules(deck_count: int, rules: bytes) -> RuleSpec:
+    # 同一种玩法的对局很多，相同的规则只解码一次
+    if not rules:
+        return RuleSpec(deck_count=deck_count)
+    return RuleSpec.from_dict(json.loads(rules))
+
+
+def iter_events(game: bytes) -> Iterator[Event]:
+    """解码一局的事件（不包括正文开头的副数、人数、首家和规则）"""
+    pos = RULES_START + RULES_LENGTH.unpack_from(game, 3)[0]
+    size = len(game)
+    while pos < size:
+        kind = game[pos]
+        if kind == EVENT_PASS:
+            yield kind, game[pos + 1], ()
+            pos += 2
+        elif kind == EVENT_END:
+            yield kind, -1, ()
+            return
+        else:
+            n = game[pos + 2]
+            yield kind, game[pos + 1], tuple(DECK[c] for c in game[pos + 3:pos + 3 + n])
+            pos += 3 + n
+
+
+def game_results(game: bytes) -> List[Tuple[int, int]]:
+    """一局每个座位的 (名次, 得分)，来自结束事件"""
+    players = game[1]
+    start = len(game) - 2 * players
+    return [(game[start + 2 * i + 1], struct.unpack_from('<b', game, start + 2 * i)[0]) for i in range(players)]
@@ -0,0 +1,191 @@
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import rule_variants
+from arrange import ACE_INDEX, FOUR_INDEX, MIN_DRAGON, MIN_VALUE, RANK_COUNT
+from card_rules import CardPattern
+
+
+@lru_cache(maxsize=1 << 16)
+def _pattern(cards: Tuple[str, ...]) -> Tuple[Optional[str], int]:
+    return CardPattern.get_pattern(list(cards))
+
+
+@lru_cache(maxsize=1 << 16)
+def _can_beat(new_cards: Tuple[str, ...], last_cards: Tuple[str, ...]) -> bool:
+    return CardPattern.can_beat(list(new_cards), list(last_cards))
+
+
+def pattern_of(cards: List[str]) -> Tuple[Optional[str], int]:
+    """带缓存的 CardPattern.get_pattern，同样的牌会被反复判断"""
+    return _pattern(tuple(cards))
+
+
+def can_beat_cached(new_cards: List[str], last_cards: List[str]) -> bool:
+    """带缓存的 CardPattern.can_beat"""
+    return _can_beat(tuple(new_cards), tuple(last_cards))
+
+
+def clear_caches() -> None:
+    """清空牌型判断的缓存（内存基准测试中排除进程级缓存的占用）"""
+    _pattern.cache_clear()
+    _can_beat.cache_clear()
+    rule_variants.clear_caches()
+
+
+class HandAnalysis:
+    """一手牌的牌型索引：发牌时建立一次，出牌（包括叉、勾）时增量更新
+
+    记录每个点数的张数、王，以及按点数的连续长度索引（龙、双龙）。
+    “这手牌能不能打过 X” 只需要检查每种牌型里最大的一手，结果在手牌变化前一直缓存。
+    计数和连续长度都放在 bytearray 里，每个玩家只占几个小对象。
+    """
+
+    __slots__ = ('cards', 'jokers', 'counts', 'run1', 'run2', '_best_plays', '_beat_cache')
+
+    def __init__(self, cards: Iterable[str] = ()) -> None:
+        self.cards: List[str] = []  # 非王的牌
+        self.jokers: List[str] = []  # 大小王
+        self.counts = bytearray(RANK_COUNT)  # 每个点数的张数
+        self.run1 = bytearray(RANK_COUNT + 1)  # 从该点数开始、每个点数至少一张的连续长度
+        self.run2 = bytearray(RANK_COUNT + 1)  # 从该点数开始、每个点数至少两张的连续长度
+        self._best_plays: Optional[List[Tuple[str, ...]]] = None  # 每种牌型最大的一手，手牌变化时失效
+        self._beat_cache: Dict[Tuple[str, ...], bool] = {}
+        for card in cards:
+            self._insert(card)
+        self._rebuild_runs()
+
+    def __len__(self) -> int:
+        return len(self.cards) + len(self.jokers)
+
+    def _insert(self, card: str) -> None:
+        if '王' in card:
+            self.jokers.append(card)
+        else:
+            self.cards.append(card)
+            self.counts[CardPattern.get_card_value(card) - MIN_VALUE] += 1
+
+    def _rebuild_runs(self) -> None:
+        for i in range(RANK_COUNT - 1, -1, -1):
+            count = self.counts[i]
+            self.run1[i] = self.run1[i + 1] + 1 if count >= 1 else 0
+            self.run2[i] = self.run2[i + 1] + 1 if count >= 2 else 0
+
+    def _changed(self) -> None:
+        self._rebuild_runs()
+        self._best_plays = None
+        self._beat_cache.clear()
+
+    def add(self, cards: Iterable[str]) -> None:
+        for card in cards:
+            self._insert(card)
+        self._changed()
+
+    def remove(self, cards: Iterable[str]) -> None:
+        """手牌中打出了这些牌"""
+        for card in cards:
+            if '王' in card:
+                self.jokers.remove(card)
+            else:
+                self.cards.remove(card)
+                self.counts[CardPattern.get_card_value(card) - MIN_VALUE] -= 1
+        self._changed()
+
+    def _by_index(self) -> List[List[str]]:
+        """按点数分组的牌（只在重新计算 best_plays 时临时生成）"""
+        by_index: List[List[str]] = [[] for _ in range(RANK_COUNT)]
+        for card in self.cards:
+            by_index[CardPattern.get_card_value(card) - MIN_VALUE].append(card)
+        return by_index
+
+    # ---- 牌型库存 ----
+
+    def count(self, index: int) -> int:
+        return self.counts[index]
+
+    @property
+    def joker_count(self) -> int:
+        return len(self.jokers)
+
+    def same_ranks(self, n: int) -> List[int]:
+        """至少有 n 张相同的点数（大小值），例如 n=4 为炸弹，n=6 为大炸弹"""
+        return [i + MIN_VALUE for i in range(RANK_COUNT) if self.counts[i] >= n]
+
+    def bomb_ranks(self) -> List[int]:
+        return self.same_ranks(4)
+
+    def rocket_count(self) -> int:
+        """最多能组成几个火箭（两张4和一张A）"""
+        return min(self.counts[FOUR_INDEX] // 2, self.counts[ACE_INDEX])
+
+    def longest_dragon(self) -> int:
+        return max(self.run1[:RANK_COUNT]) if max(self.run1[:RANK_COUNT]) >= MIN_DRAGON else 0
+
+    def longest_double_dragon(self) -> int:
+        return max(self.run2[:RANK_COUNT]) if max(self.run2[:RANK_COUNT]) >= MIN_DRAGON else 0
+
+    def dragon_runs(self, double: bool = False) -> List[Tuple[int, int]]:
+        """所有极长的连续段 (起始大小值, 长度)，长度至少 3"""
+        runs = self.run2 if double else self.run1
+        return [(i + MIN_VALUE, runs[i]) for i in range(RANK_COUNT)
+                if runs[i] >= MIN_DRAGON and (i == 0 or runs[i - 1] == 0)]
+
+    # ---- 查询 ----
+
+    def best_plays(self) -> List[Tuple[str, ...]]:
+        """每种牌型（龙和双龙按长度区分）中最大的一手"""
+        if self._best_plays is not None:
+            return self._best_plays
+        by_index = self._by_index()
+        plays: List[List[str]] = []
+        # 同点数 1~n 张（一副牌最多四张，三副以上可以超过八张）：取张数足够的最大点数
+        for n in range(1, max(self.counts, default=0) + 1):
+            for i in range(RANK_COUNT - 1, -1, -1):
+                if self.counts[i] >= n:
+                    plays.append(by_index[i][:n])
+                    break
+        # 王：单张取大王，多张取任意
+        if self.jokers:
+            plays.append(['大王'] if '大王' in self.jokers else ['小王'])
+            for n in range(2, len(self.jokers) + 1):
+                plays.append(self.jokers[:n])
+        # 火箭：一手杂色的，加上每种花色的同花色火箭（只有同花色的火箭才可能打过别的火箭，
+        # 有的玩法里同花色火箭之间还要比花色）
+        if self.rocket_count():
+            fours = by_index[FOUR_INDEX]
+            aces = by_index[ACE_INDEX]
+            plays.append(fours[:2] + aces[:1])
+            suits = set()
+            for ace in aces:
+                if ace[0] in suits:
+                    continue
+                suits.add(ace[0])
+                same_suit = [c for c in fours if c[0] == ace[0]]
+                if len(same_suit) >= 2:
+                    plays.append(same_suit[:2] + [ace])
+        # 龙与双龙：每个长度取结束点数最大的一段
+        for runs, need in ((self.run1, 1), (self.run2, 2)):
+            for length in range(MIN_DRAGON, RANK_COUNT + 1):
+                start = next((i for i in range(RANK_COUNT - length, -1, -1) if runs[i] >= length), None)
+                if start is None:
+                    break
+                plays.append([c for i in range(start, start + length) for c in by_index[i][:need]])
+        # 存成元组：直接作为 _can_beat 缓存的键
+        self._best_plays = [tuple(play) for play in plays]
+        return self._best_plays
+
+    def can_beat(self, last_cards: List[str],
+                 beats: Callable[[Tuple[str, ...], Tuple[str, ...]], bool] = _can_beat) -> bool:
+        """这手牌里有没有能打过 last_cards 的出牌；beats 是房间玩法的比较函数（RuleTables.beats）
+
+        同一牌型中，最大的一手打不过就没有能打过的，所以只需检查 best_plays。
+        一手牌只会在同一个房间里查询，所以结果缓存不区分玩法。
+        """
+        if not last_cards:
+            return len(self) > 0
+        key = tuple(last_cards)
+        result = self._beat_cache.get(key)
+        if result is None:
+            result = any(beats(play, key) for play in self.best_plays())
+            self._beat_cache[key] = result
+        return result
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from executor import get_thread_pool
+from metrics import REGISTRY, Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 256  # 一个事务最多写入几局
+FLUSH_INTERVAL = 0.5  # 凑批最多等待的时间（秒）
+HISTORY_CACHE_SIZE = 4096  # 缓存多少名玩家的最近战绩
+
+LEDGER_WRITES = REGISTRY.register(Counter('silverpoker_ledger_games_total', '写入积分账本的对局数'))
+LEDGER_COMMIT = REGISTRY.register(Histogram(
+    'silverpoker_ledger_commit_seconds', '积分账本一次批量提交的耗时',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    player_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    games INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS players_total ON players (total DESC);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    player_id TEXT NOT NULL,
+    room_id TEXT,
+    position INTEGER NOT NULL,
+    players INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_player ON results (player_id, id DESC);
+"""
+
+# 一局中一名玩家的结果：(玩家标识, 名称, 名次（从 0 开始）, 本局得分)
+Result = Tuple[str, str, int, int]
+
+
+class Ledger:
+    """持久化的积分账本（SQLite，WAL 模式）
+
+    record_game() 只把结果放进队列，由后台写线程凑批后在一个事务里写入，IOLoop 从不等待磁盘。
+    排行榜和个人战绩从内存缓存读取，每次提交后缓存失效；缓存未命中时在线程池中查询。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._queue: queue.Queue = queue.Queue()
+        self._local = threading.local()  # 每个线程自己的只读连接
+        self._cache_lock = threading.Lock()
+        self._top_cache: Dict[int, List[Dict[str, Any]]] = {}
+        self._history_cache: 'OrderedDict[Tuple[str, int], List[Dict[str, Any]]]' = OrderedDict()
+        self._generation = 0  # 每次提交后加一，查询结果只在代数没变时写入缓存
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.close()
+        self._writer = threading.Thread(target=self._write_loop, name='ledger-writer', daemon=True)
+        self._writer.start()
+        REGISTRY.register(Gauge('silverpoker_ledger_pending', '等待写入积分账本的对局数',
+                                fn=lambda: self._queue.qsize()))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')  # WAL 下只在检查点时 fsync
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # ---- 写入 ----
+
+    def record_game(self, room_id: Optional[str], players: int, results: List[Result]) -> None:
+        """记录一局的结果（不阻塞）；players 是这一局的总人数（含机器人和未表明身份的玩家）"""
+        if results:
+            self._queue.put((room_id, players, results, time.time()))
+
+    def close(self, timeout: float = 5.0) -> None:
+        """写完队列中剩下的结果后停止写线程"""
+        self._queue.put(None)
+        self._writer.join(timeout)
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            if not batch:
+                continue
+            start = time.perf_counter()
+            try:
+                self._write_batch(conn, batch)
+                written = len(batch)
+            except sqlite3.Error:
+                logger.exception("批量写入积分账本失败，改为逐局写入 %d 局结果", len(batch))
+                written = 0
+            if not written:
+                # 整批已回滚，逐局重写，只丢弃本身写不进去的那几局
+                for game in batch:
+                    try:
+                        self._write_batch(conn, [game])
+                        written += 1
+                    except sqlite3.Error:
+                        logger.exception("写入积分账本失败，丢弃房间 %s 的一局结果", game[0])
+            LEDGER_COMMIT.observe(time.perf_counter() - start)
+            if written:
+                LEDGER_WRITES.inc(written)
+                self._invalidate()
+        conn.close()
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, batch: List[Tuple[Optional[str], int, List[Result], float]]) -> None:
+        conn.execute('BEGIN')
+        try:
+            for room_id, players, results, finished_at in batch:
+                conn.executemany(
+                    'INSERT INTO players (player_id, name, total, games, wins, updated_at) '
+                    'VALUES (?, ?, ?, 1, ?, ?) '
+                    'ON CONFLICT(player_id) DO UPDATE SET name = excluded.name, '
+                    'total = total + excluded.total, games = games + 1, wins = wins + excluded.wins, '
+                    'updated_at = excluded.updated_at',
+                    [(pid, name, score, 1 if position == 0 else 0, finished_at)
+                     for pid, name, position, score in results])
+                conn.executemany(
+                    'INSERT INTO results (player_id, room_id, position, players, score, finished_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(pid, room_id, position, players, score, finished_at)
+                     for pid, name, position, score in results])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    # ---- 查询 ----
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _invalidate(self) -> None:
+        with self._cache_lock:
+            self._generation += 1
+            self._top_cache.clear()
+            self._history_cache.clear()
+
+    def top(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """总分排行榜（同步；在 IOLoop 中请用 top_async）"""
+        with self._cache_lock:
+            cached = self._top_cache.get(limit)
+            generation = self._generation
+        if cached is not None:
+            return cached
+        rows = self._reader().execute(
+            'SELECT player_id, name, total, games, wins FROM players ORDER BY total DESC, player_id LIMIT ?',
+            (limit,)).fetchall()
+        result = [dict(row) for row in rows]
+        with self._cache_lock:
+            if generation == self._generation:
+                self._top_cache[limit] = result
+        return result
+
+    def history(self, player_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """玩家最近的战绩，新的在前"""
+        key = (player_id, limit)
+        with self._cache_lock:
+            cached = self._history_cache.get(key)
+            if cached is not None:
+                self._history_cache.move_to_end(key)
+            generation = self._generation
+        if cached is not None:
+            return cached
+        rows = self._reader().execute(
+            'SELECT room_id, position, players, score, finished_at FROM results '
+            'WHERE player_id = ? ORDER BY id DESC LIMIT ?', (player_id, limit)).fetchall()
+        result = [dict(row) for row in rows]
+        with self._cache_lock:
+            if generation == self._generation:
+                self._history_cache[key] = result
+                if len(self._history_cache) > HISTORY_CACHE_SIZE:
+                    self._history_cache.popitem(last=False)
+        return result
+
+    async def top_async(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._cache_lock:
+            cached = self._top_cache.get(limit)
+        if cached is not None:
+            return cached
+        return await asyncio.get_running_loop().run_in_executor(get_thread_pool(), self.top, limit)
+
+    async def history_async(self, player_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._cache_lock:
+            cached = self._history_cache.get((player_id, limit))
+        if cached is not None:
+            return cached
+        return await asyncio.get_running_loop().run_in_executor(get_thread_pool(), self.history, player_id, limit)
@@ -0,0 +1,133 @@
+import random
+import time
+from collections import defaultdict
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY, Histogram
+
+MATCH_WAIT = REGISTRY.register(Histogram(
+    'silverpoker_match_wait_seconds', '快速匹配从排队到成桌的等待时间',
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)))
+
+Key = Tuple[int, int]
+
+
+class Lobby:
+    """大厅：开放房间的增量索引和快速匹配队列
+
+    开放房间（标准玩法、未开局、有真人、没坐满）按 (牌副数, 空位数) 分桶，房间人数或状态变化时
+    由 GameRoom 回调 update() 把它移到对应的桶里。查询只遍历桶，不扫描所有房间。
+    """
+
+    def __init__(self, rooms: Dict[str, Any], max_players: int) -> None:
+        self.rooms = rooms  # 与 GameHandler.rooms 是同一个字典
+        self.max_players = max_players
+        self._open: Dict[Key, Dict[str, None]] = defaultdict(dict)  # (牌副数, 空位数) -> 房间号（按开放先后）
+        self._room_keys: Dict[str, Key] = {}  # 房间号 -> 所在的桶
+        self._queues: Dict[Key, Dict[Any, float]] = defaultdict(dict)  # (牌副数, 人数) -> 等待的玩家和排队时间
+        self._waiting: Dict[Any, Key] = {}  # 玩家 -> 所在的队列
+
+    # ---- 房间索引 ----
+
+    def new_room_id(self) -> str:
+        """生成未被占用的房间号；房间多到四位数不够用时自动加长"""
+        digits = 4
+        while len(self.rooms) * 2 >= 9 * 10 ** (digits - 1):
+            digits += 1
+        while True:
+            room_id = str(random.randint(10 ** (digits - 1), 10 ** digits - 1))
+            if room_id not in self.rooms:
+                return room_id
+
+    def update(self, room: Any) -> None:
+        """房间人数或开局状态变化后调用"""
+        room_id = room.room_id
+        free = self.max_players - len(room.players)
+        # 非标准玩法的房间只能凭房间号加入，不进大厅列表
+        key = (room.deck_count, free) if not room.game_started and 0 < free < self.max_players \
+            and room.rules.standard and room.has_humans() else None
+        old = self._room_keys.get(room_id)
+        if old == key:
+            return
+        if old is not None:
+            self._remove(room_id, old)
+        if key is not None:
+            self._open[key][room_id] = None
+            self._room_keys[room_id] = key
+
+    def discard(self, room_id: str) -> None:
+        """房间被删除"""
+        old = self._room_keys.get(room_id)
+        if old is not None:
+            self._remove(room_id, old)
+
+    def _remove(self, room_id: str, key: Key) -> None:
+        bucket = self._open[key]
+        del bucket[room_id]
+        if not bucket:
+            del self._open[key]
+        del self._room_keys[room_id]
+
+    def open_count(self) -> int:
+        return len(self._room_keys)
+
+    def list_rooms(self, deck_count: Optional[int] = None, min_free: int = 1,
+                   offset: int = 0, limit: int = 20) -> Tuple[int, List[Dict[str, Any]]]:
+        """分页列出开放房间，空位少的（快坐满的）在前；返回 (符合条件的总数, 本页房间)
+
+        总数由各桶大小相加得到，翻页时整桶跳过，代价只与桶数和 offset + limit 有关。
+        """
+        keys = sorted((k for k in self._open if k[1] >= min_free and deck_count in (None, k[0])),
+                      key=lambda k: (k[1], k[0]))
+        total = sum(len(self._open[k]) for k in keys)
+        page: List[Dict[str, Any]] = []
+        for key in keys:
+            bucket = self._open[key]
+            if offset >= len(bucket):
+                offset -= len(bucket)
+                continue
+            for room_id in islice(bucket, offset, offset + limit - len(page)):
+                page.append({'room_id': room_id, 'deck_count': key[0],
+                             'player_count': self.max_players - key[1], 'free_seats': key[1]})
+            offset = 0
+            if len(page) >= limit:
+                break
+        return total, page
+
+    # ---- 快速匹配 ----
+
+    def enqueue(self, player: Any, deck_count: int, size: int) -> Optional[List[Any]]:
+        """加入快速匹配队列；人数凑够 size 时返回这一桌的玩家（按排队先后），否则返回 None"""
+        self.cancel(player)
+        key = (deck_count, size)
+        queue = self._queues[key]
+        queue[player] = time.monotonic()
+        self._waiting[player] = key
+        if len(queue) < size:
+            return None
+        now = time.monotonic()
+        group = list(islice(queue, size))
+        for p in group:
+            MATCH_WAIT.observe(now - queue.pop(p))
+            del self._waiting[p]
+        if not queue:
+            del self._queues[key]
+        return group
+
+    def cancel(self, player: Any) -> bool:
+        """退出匹配队列；返回玩家之前是否在排队"""
+        key = self._waiting.pop(player, None)
+        if key is None:
+            return False
+        queue = self._queues[key]
+        del queue[player]
+        if not queue:
+            del self._queues[key]
+        return True
+
+    def queue_length(self, deck_count: int, size: int) -> int:
+        return len(self._queues.get((deck_count, size), ()))
+
+    def waiting_count(self) -> int:
+        return len(self._waiting)
@@ -0,0 +1,201 @@
+import argparse
+import glob
+import json
+import os
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from executor import get_process_pool
+from gamelog import EVENT_END, EVENT_FORK, EVENT_HOOK, EVENT_PASS, game_results, game_rules, iter_events, iter_games
+from rule_variants import VARIANTS, RuleSpec, compile_rules
+
+CHUNK_GAMES = 100000  # 每个任务最多处理几局，处理完一块就合并并写一次检查点
+
+
+_variant_names: Dict[Tuple[Any, ...], str] = {}
+
+
+def variant_name(spec: RuleSpec) -> str:
+    """玩法对应的预设名；不是任何预设时为 custom"""
+    key = spec.key()
+    name = _variant_names.get(key)
+    if name is None:
+        name = 'custom'
+        for preset, fields in VARIANTS.items():
+            if RuleSpec.from_dict({'deck_count': spec.deck_count, **fields}).key() == key:
+                name = preset
+                break
+        _variant_names[key] = name
+    return name
+
+
+class Stats:
+    """可合并的统计量：每个进程统计自己那一块，主进程逐块合并
+
+    所有计数都以字符串为键，直接存进 JSON 检查点。
+    """
+
+    FIELDS = ('games', 'moves', 'plays', 'passes', 'singles', 'forks', 'hooks', 'patterns', 'scores', 'first_place')
+
+    def __init__(self) -> None:
+        self.games: Counter = Counter()  # "副数-人数"（非标准玩法再加 "-玩法"）-> 局数
+        self.moves: Counter = Counter()  # 同上的键 -> 动作数（出牌、叉、勾、过），用于平均对局长度
+        self.plays: Counter = Counter()
+        self.passes: Counter = Counter()
+        self.singles: Counter = Counter()  # 出单张的次数（可能被叉的机会）
+        self.forks: Counter = Counter()
+        self.hooks: Counter = Counter()
+        self.patterns: Counter = Counter()  # 牌型 -> 出现次数
+        self.scores: Counter = Counter()  # "副数-人数-座位:得分" -> 次数
+        self.first_place: Counter = Counter()  # "副数-人数-座位" -> 头游次数
+
+    def add_game(self, game: bytes) -> None:
+        # 牌型按这一局自己的玩法识别（关掉的牌型、火箭规则都可能不同）
+        spec = game_rules(game)
+        rules = compile_rules(spec)
+        name = variant_name(spec)
+        key = f'{game[0]}-{game[1]}' if name == 'standard' else f'{game[0]}-{game[1]}-{name}'
+        self.games[key] += 1
+        for kind, seat, cards in iter_events(game):
+            if kind == EVENT_END:
+                break
+            self.moves[key] += 1
+            if kind == EVENT_PASS:
+                self.passes[key] += 1
+            elif kind == EVENT_FORK:
+                self.forks[key] += 1
+            elif kind == EVENT_HOOK:
+                self.hooks[key] += 1
+            else:
+                self.plays[key] += 1
+                if len(cards) == 1:
+                    self.singles[key] += 1
+                self.patterns[rules.pattern(cards)[0]] += 1
+        for seat, (position, score) in enumerate(game_results(game)):
+            self.scores[f'{key}-{seat}:{score}'] += 1
+            if position == 0:
+                self.first_place[f'{key}-{seat}'] += 1
+
+    def merge(self, other: 'Stats') -> None:
+        for name in self.FIELDS:
+            getattr(self, name).update(getattr(other, name))
+
+    def to_dict(self) -> Dict[str, Dict[str, int]]:
+        return {name: dict(getattr(self, name)) for name in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Dict[str, int]]) -> 'Stats':
+        stats = cls()
+        for name in cls.FIELDS:
+            getattr(stats, name).update(data.get(name, {}))
+        return stats
+
+    def report(self) -> Dict[str, Any]:
+        """汇总成便于阅读的结果"""
+        result: Dict[str, Any] = {'games': sum(self.games.values()), 'by_table': {}}
+        for key, games in sorted(self.games.items()):
+            singles = self.singles[key]
+            result['by_table'][key] = {
+                'games': games,
+                'avg_moves': self.moves[key] / games,
+                'avg_plays': self.plays[key] / games,
+                'fork_rate': self.forks[key] / singles if singles else 0.0,  # 单张被叉的比例
+                'hook_rate': self.hooks[key] / self.forks[key] if self.forks[key] else 0.0,  # 叉被勾的比例
+                'forks_per_game': self.forks[key] / games,
+                'hooks_per_game': self.hooks[key] / games,
+            }
+        total_plays = sum(self.patterns.values()) or 1
+        result['patterns'] = {p: n / total_plays for p, n in self.patterns.most_common()}
+        # 每个座位的得分分布和平均分
+        seats: Dict[str, Dict[str, Any]] = {}
+        for key, n in self.scores.items():
+            seat_key, score = key.rsplit(':', 1)
+            entry = seats.setdefault(seat_key, {'distribution': {}, 'games': 0, 'total': 0})
+            entry['distribution'][int(score)] = n
+            entry['games'] += n
+            entry['total'] += int(score) * n
+        result['seats'] = {
+            key: {'avg_score': entry['total'] / entry['games'],
+                  'first_place_rate': self.first_place[key] / entry['games'],
+                  'distribution': dict(sorted(entry['distribution'].items()))}
+            for key, entry in sorted(seats.items())
+        }
+        return result
+
+
+def analyze_chunk(path: str, offset: int, max_games: int) -> Tuple[Dict[str, Dict[str, int]], int, bool]:
+    """在进程池中统计一个文件从 offset 开始的至多 max_games 局，返回 (统计, 新偏移, 是否读到文件末尾)"""
+    stats = Stats()
+    games = 0
+    for offset, game in iter_games(path, offset):
+        stats.add_game(game)
+        games += 1
+        if games >= max_games:
+            return stats.to_dict(), offset, False
+    return stats.to_dict(), offset, True
+
+
+def load_checkpoint(path: Optional[str]) -> Tuple[Dict[str, int], Stats]:
+    """读取检查点：(每个文件已处理到的偏移, 已合并的统计)"""
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return data['offsets'], Stats.from_dict(data['stats'])
+    return {}, Stats()
+
+
+def save_checkpoint(path: str, offsets: Dict[str, int], stats: Stats) -> None:
+    # 先写临时文件再替换，进程在写的过程中被杀也不会留下损坏的检查点
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'offsets': offsets, 'stats': stats.to_dict()}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def log_files(paths: Iterable[str]) -> Iterator[str]:
+    """展开目录为其中的 *.log 文件"""
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(glob.glob(os.path.join(path, '*.log')))
+        else:
+            yield path
+
+
+def analyze(paths: List[str], checkpoint: Optional[str] = None, executor: Optional[Executor] = None,
+            chunk_games: int = CHUNK_GAMES) -> Stats:
+    """并行统计多个日志文件，每合并一块就更新检查点；再次运行时从检查点继续
+
+    同一文件的各块按顺序提交（下一块的起点要等上一块读完才知道），不同文件之间并行。
+    """
+    executor = executor or get_process_pool()
+    offsets, stats = load_checkpoint(checkpoint)
+    running: Dict[Future, str] = {}
+    for path in log_files(paths):
+        path = os.path.abspath(path)
+        running[executor.submit(analyze_chunk, path, offsets.get(path, 0), chunk_games)] = path
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            path = running.pop(future)
+            partial, offset, finished = future.result()
+            stats.merge(Stats.from_dict(partial))
+            offsets[path] = offset
+            if checkpoint:
+                save_checkpoint(checkpoint, offsets, stats)
+            if not finished:
+                running[executor.submit(analyze_chunk, path, offset, chunk_games)] = path
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="统计对局日志：牌型频率、叉勾比例、对局长度、各座位得分分布")
+    parser.add_argument('paths', nargs='+', help="日志文件或目录")
+    parser.add_argument('--checkpoint', help="检查点文件，中断后再次运行会从这里继续")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk', type=int, default=CHUNK_GAMES, help="每块处理的局数")
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        result = analyze(args.paths, args.checkpoint, pool, args.chunk)
+    print(json.dumps(result.report(), ensure_ascii=False, indent=2))
@@ -0,0 +1,142 @@
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import tornado.web
+
+# 默认的耗时分桶（秒），覆盖 0.1ms ~ 2.5s
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+
+def _labels_text(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """只增不减的计数器，可带标签"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for key, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_labels_text(self.labels, key)} {value:g}')
+        return lines
+
+
+class Gauge:
+    """瞬时值；给定 fn 时在抓取时才计算"""
+
+    def __init__(self, name: str, help_text: str, fn: Optional[Callable[[], float]] = None) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+        self.value: float = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def render(self) -> List[str]:
+        value = self.fn() if self.fn is not None else self.value
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge', f'{self.name} {value:g}']
+
+
+class Histogram:
+    """分桶直方图，可带标签；observe 只做一次二分查找和几次加法"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # 标签 -> [各桶计数（非累计，最后一个为 +Inf）, 总和, 次数]
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                labels = _labels_text(self.labels, key, 'le="%s"' % le)
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels_text(self.labels, key)} {total:g}')
+            lines.append(f'{self.name}_count{_labels_text(self.labels, key)} {count}')
+        return lines
+
+
+class Registry:
+    """指标注册表，按 Prometheus 文本格式输出"""
+
+    def __init__(self) -> None:
+        self.metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+ACTION_LATENCY = REGISTRY.register(Histogram(
+    'silverpoker_action_seconds', '处理一条客户端消息的耗时（按 action 区分）', labels=('action',)))
+BROADCAST_FRAMES = REGISTRY.register(Counter(
+    'silverpoker_broadcast_frames_total', '发送给玩家的广播消息条数（按 action 区分）', labels=('action',)))
+BROADCAST_BYTES = REGISTRY.register(Counter(
+    'silverpoker_broadcast_bytes_total', '发送给玩家的广播消息字节数（按 action 区分）', labels=('action',)))
+CONNECTIONS = REGISTRY.register(Gauge('silverpoker_connections', '当前 WebSocket 连接数'))
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """/metrics：Prometheus 文本格式"""
+
+    def get(self) -> None:
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(REGISTRY.render())
+
+
+def make_metrics_app(extra_handlers: Sequence[tuple] = ()) -> tornado.web.Application:
+    """本机管理端口上的应用；extra_handlers 用于挂载调试接口"""
+    return tornado.web.Application([
+        (r"/metrics", MetricsHandler),
+        *extra_handlers,
+    ])
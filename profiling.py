@@ -0,0 +1,289 @@
+import gc
+import inspect
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+import tornado.ioloop
+import tornado.web
+
+from executor import get_thread_pool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.005  # 采样间隔（秒）
+MAX_SECONDS = 60.0
+TRACE_FRAMES = 25  # tracemalloc 每次分配记录的调用栈深度
+
+# 这些模块里分配的内存算作消息缓冲区（收发中的 WebSocket 帧、JSON 编解码）
+BUFFER_MODULES = (
+    os.path.join('tornado', 'websocket.py'),
+    os.path.join('tornado', 'iostream.py'),
+    os.path.join('tornado', 'escape.py'),
+    os.path.join('json', ''),
+)
+
+
+class SamplingProfiler:
+    """采样式 CPU 分析：后台线程定时读取所有线程的调用栈
+
+    只在 run() 期间有一个采样线程，不使用 sys.setprofile，未运行时没有任何开销。
+    """
+
+    _lock = threading.Lock()  # 同一时间只允许一次分析
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL) -> None:
+        self.interval = interval
+        self.ticks = 0  # 采样次数
+        self.samples = 0  # 非空闲线程的样本数
+        self.self_counts: Counter = Counter()  # 位于栈顶的次数
+        self.total_counts: Counter = Counter()  # 出现在栈中的次数
+
+    def _sample(self, ignore: int) -> None:
+        self.ticks += 1
+        for ident, frame in sys._current_frames().items():
+            if ident == ignore:
+                continue
+            # 空闲线程停在 select/wait 上，不计入
+            if frame.f_code.co_name in ('select', 'poll', 'wait', '_worker', 'epoll'):
+                continue
+            self.samples += 1
+            seen = set()
+            top = True
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, frame.f_lineno if top else code.co_firstlineno, code.co_name)
+                if top:
+                    self.self_counts[key] += 1
+                    top = False
+                func = (code.co_filename, code.co_firstlineno, code.co_name)
+                if func not in seen:
+                    seen.add(func)
+                    self.total_counts[func] += 1
+                frame = frame.f_back
+
+    def run(self, seconds: float) -> 'SamplingProfiler':
+        """在当前线程中采样 seconds 秒（应在 IOLoop 以外的线程调用）"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("已有分析在运行")
+        try:
+            me = threading.get_ident()
+            deadline = time.monotonic() + min(seconds, MAX_SECONDS)
+            while time.monotonic() < deadline:
+                self._sample(me)
+                time.sleep(self.interval)
+        finally:
+            self._lock.release()
+        return self
+
+    def top(self, limit: int = 30) -> Dict[str, Any]:
+        def rows(counts: Counter) -> List[Dict[str, Any]]:
+            return [{'file': _short_path(f), 'line': line, 'func': name,
+                     'samples': n, 'percent': 100.0 * n / max(self.samples, 1)}
+                    for (f, line, name), n in counts.most_common(limit)]
+        return {'ticks': self.ticks, 'samples': self.samples, 'self': rows(self.self_counts), 'cumulative': rows(self.total_counts)}
+
+    def format(self, limit: int = 30) -> str:
+        result = self.top(limit)
+        lines = [f"采样 {result['ticks']} 次，非空闲样本 {result['samples']} 个"]
+        for title, key in (('栈顶（自身耗时）', 'self'), ('累计（含调用）', 'cumulative')):
+            lines.append(f'-- {title} --')
+            for row in result[key]:
+                lines.append(f"{row['percent']:6.1f}% {row['samples']:6d}  {row['func']}  {row['file']}:{row['line']}")
+        return '\n'.join(lines)
+
+
+def _short_path(path: str) -> str:
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and path.startswith(prefix + os.sep):
+            return path[len(prefix) + 1:]
+    return path
+
+
+def profile(seconds: float, limit: int = 30, interval: float = DEFAULT_INTERVAL) -> Dict[str, Any]:
+    """运行一次采样分析，返回栈顶和累计的热点帧"""
+    return SamplingProfiler(interval).run(seconds).top(limit)
+
+
+# ---- 内存 ----
+
+def _class_ranges(classes: Iterable[type]) -> List[Tuple[str, str, int, int]]:
+    """每个类的源码范围：(名称, 文件, 起始行, 结束行)"""
+    ranges = []
+    for cls in classes:
+        try:
+            lines, start = inspect.getsourcelines(cls)
+            ranges.append((cls.__name__, inspect.getsourcefile(cls), start, start + len(lines) - 1))
+        except (OSError, TypeError):
+            continue
+    return ranges
+
+
+def start_tracing(nframes: int = TRACE_FRAMES) -> bool:
+    """开始跟踪内存分配；返回是否新开始（已在跟踪时返回 False）"""
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(nframes)
+    return True
+
+
+def stop_tracing() -> None:
+    tracemalloc.stop()
+
+
+def memory_snapshot(classes: Sequence[type], limit: int = 20) -> Dict[str, Any]:
+    """按类归属统计跟踪开始以来仍存活的内存
+
+    一块内存归属于调用栈中离分配点最近的那个类（如 GameRoom、GameHandler）的方法；
+    在 tornado WebSocket / JSON 中分配的归为消息缓冲区。需要先 start_tracing()。
+    """
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("内存跟踪未开启")
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    ))
+    ranges = _class_ranges(classes)
+    by_owner: Dict[str, List[int]] = {}  # 归属 -> [字节数, 块数]
+
+    def owner(traceback: tracemalloc.Traceback) -> str:
+        for frame in reversed(traceback):  # 从离分配点最近的帧开始
+            for name, filename, start, end in ranges:
+                if frame.filename == filename and start <= frame.lineno <= end:
+                    return name
+            if any(module in frame.filename for module in BUFFER_MODULES):
+                return '消息缓冲区'
+        return '其他'
+
+    stats = snapshot.statistics('traceback')
+    for stat in stats:
+        entry = by_owner.setdefault(owner(stat.traceback), [0, 0])
+        entry[0] += stat.size
+        entry[1] += stat.count
+    traced, peak = tracemalloc.get_traced_memory()
+    return {
+        'traced_bytes': traced,
+        'peak_bytes': peak,
+        'by_owner': {name: {'bytes': size, 'blocks': count}
+                     for name, (size, count) in sorted(by_owner.items(), key=lambda kv: -kv[1][0])},
+        'top_lines': [{'file': _short_path(stat.traceback[-1].filename), 'line': stat.traceback[-1].lineno,
+                       'bytes': stat.size, 'blocks': stat.count}
+                      for stat in snapshot.statistics('lineno')[:limit]],
+    }
+
+
+def deep_sizeof(obj: Any, stop: Callable[[Any], bool] = lambda o: False) -> int:
+    """对象及其引用到的所有对象的大小；stop(o) 为真的对象（如玩家连接）不计入也不展开"""
+    seen = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        o = pending.pop()
+        if id(o) in seen or isinstance(o, (type, types.ModuleType)) or callable(o) or (o is not obj and stop(o)):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        pending.extend(gc.get_referents(o))
+    return size
+
+
+# ---- 管理接口 ----
+
+class _AdminHandler(tornado.web.RequestHandler):
+    def prepare(self) -> None:
+        # 管理端口只监听本机；另外设置了 SILVERPOKER_ADMIN_TOKEN 时要求携带
+        token = os.environ.get('SILVERPOKER_ADMIN_TOKEN')
+        if token and self.request.headers.get('X-Admin-Token', self.get_argument('token', '')) != token:
+            raise tornado.web.HTTPError(403)
+
+
+class ProfileHandler(_AdminHandler):
+    """/debug/profile?seconds=5&top=30：采样分析运行中的进程"""
+
+    async def get(self) -> None:
+        seconds = float(self.get_argument('seconds', '5'))
+        limit = int(self.get_argument('top', '30'))
+        loop = tornado.ioloop.IOLoop.current()
+        try:
+            # 采样线程独立运行，IOLoop 照常处理请求（也会出现在样本中）
+            result = await loop.run_in_executor(None, profile, seconds, limit)
+        except RuntimeError as e:
+            raise tornado.web.HTTPError(409, reason=str(e))
+        self.write(result)
+
+
+class MemoryHandler(_AdminHandler):
+    """/debug/memory?action=start|snapshot|stop&rooms=10：按需开启 tracemalloc 并按归属统计，房间大小只抽样 rooms 个"""
+
+    def initialize(self, classes: Sequence[type], rooms: Callable[[], Dict[str, Any]],
+                   stop: Callable[[Any], bool]) -> None:
+        self.classes = classes
+        self.rooms = rooms
+        self.stop = stop
+
+    async def get(self) -> None:
+        action = self.get_argument('action', 'snapshot')
+        if action == 'start':
+            self.write({'started': start_tracing()})
+        elif action == 'stop':
+            stop_tracing()
+            self.write({'stopped': True})
+        elif action == 'snapshot':
+            if not tracemalloc.is_tracing():
+                raise tornado.web.HTTPError(409, reason="tracemalloc not started")
+            limit = int(self.get_argument('top', '20'))
+            # 房间多时只抽样 rooms 个统计大小，遍历对象图很慢
+            rooms = list(self.rooms().items())
+            sample = random.sample(rooms, min(len(rooms), max(int(self.get_argument('rooms', '10')), 0)))
+            loop = tornado.ioloop.IOLoop.current()
+            result = await loop.run_in_executor(get_thread_pool(), self._snapshot, limit, sample)
+            result['rooms_total'] = len(rooms)
+            self.write(result)
+        else:
+            raise tornado.web.HTTPError(400)
+
+    def _snapshot(self, limit: int, rooms: List[Tuple[str, Any]]) -> Dict[str, Any]:
+        """在线程池中运行，不阻塞 IOLoop；房间大小是近似值（统计期间房间仍在变化）"""
+        result = memory_snapshot(self.classes, limit)
+        result['rooms'] = {room_id: deep_sizeof(room, self.stop) for room_id, room in rooms}
+        return result
+
+
+def install_signal_handlers(seconds: float = 10.0) -> None:
+    """SIGUSR1：后台采样 seconds 秒并写入日志；SIGUSR2：开启/关闭内存跟踪（关闭前记录快照）"""
+    snapshot_lock = threading.Lock()
+
+    def on_profile(signum: int, frame: Any) -> None:
+        def work() -> None:
+            try:
+                logger.warning("CPU 采样结果:\n%s", SamplingProfiler().run(seconds).format())
+            except RuntimeError as e:
+                logger.warning("%s", e)
+        threading.Thread(target=work, name='profiler', daemon=True).start()
+
+    def on_memory(signum: int, frame: Any) -> None:
+        if start_tracing():
+            logger.warning("内存跟踪已开启，再次发送 SIGUSR2 输出快照并关闭")
+            return
+
+        def work() -> None:
+            with snapshot_lock:
+                if not tracemalloc.is_tracing():  # 连续发送信号时只输出一次
+                    return
+                stats = tracemalloc.take_snapshot().statistics('lineno')[:30]
+                stop_tracing()
+            logger.warning("内存快照:\n%s", '\n'.join(str(stat) for stat in stats))
+        threading.Thread(target=work, name='memory-snapshot', daemon=True).start()
+
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, on_profile)
+        signal.signal(signal.SIGUSR2, on_memory)
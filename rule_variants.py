@@ -0,0 +1,322 @@
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple, Union
+
+from card_rules import DECK, CardPattern
+
+# 规则变体：RuleSpec 描述一种玩法，建房时编译成 RuleTables。
+#
+# 编译结果是查表用的数据：张数 -> 同点数牌型、张数 -> 王牌型、(新牌型, 上一手牌型) -> 比较方式。
+# 出牌时只查表，不再按玩法分支，所以增加玩法不会让每一手牌变慢。
+# 默认玩法（standard）编译出的表与 CardPattern 的判断完全一致（用 fuzz_rules.py 验证）。
+
+MAX_DECKS = 4
+MAX_PLAYERS_LIMIT = 12
+CACHE_SIZE = 1 << 16  # 每套规则的牌型和比较结果缓存条数
+MAX_COMPILED = 64  # 最多保留几套编译好的规则（预设之外的玩法由客户端决定，不能无限增长）
+
+ROCKET_SUITED = 'suited'  # 同花色火箭能打杂色火箭（现行规则）
+ROCKET_SUIT_ORDER = 'suit_order'  # 另外同花色火箭之间按 ♥ > ♦ > ♠ > ♣ 比较
+ROCKET_NONE = 'none'  # 火箭之间不能互打
+ROCKET_RULES = (ROCKET_SUITED, ROCKET_SUIT_ORDER, ROCKET_NONE)
+SUIT_ORDER = {'♣': 0, '♠': 1, '♦': 2, '♥': 3}
+
+CARD_VALUE: Dict[str, int] = {card: CardPattern.get_card_value(card) for card in DECK}
+ROCKET_VALUES = sorted((CardPattern.get_card_value('4'),) * 2 + (CardPattern.get_card_value('A'),))
+
+# 同点数 n 张的牌型和基础大小（大小 = 基础 + 点数）；超过八张的只有三副牌以上才有
+SAME_KINDS: Dict[int, Tuple[str, int]] = {
+    1: (CardPattern.PATTERN_SINGLE, 0),
+    2: (CardPattern.PATTERN_PAIR, 0),
+    3: (CardPattern.PATTERN_TRIPLE, 200),
+    4: (CardPattern.PATTERN_BOMB, 300),
+    5: (CardPattern.PATTERN_BIG_TRIPLE, 500),
+    6: (CardPattern.PATTERN_BIG_BOMB, 600),
+    7: (CardPattern.PATTERN_HUGE_TRIPLE, 900),
+    8: (CardPattern.PATTERN_HUGE_BOMB, 1100),
+}
+JOKER_KINDS: Dict[int, Tuple[str, int]] = {
+    2: (CardPattern.PATTERN_DOUBLE_JOKER, 400),
+    3: (CardPattern.PATTERN_TRIPLE_JOKER, 800),
+    4: (CardPattern.PATTERN_FOUR_JOKER, 1300),
+}
+
+# 能打其他牌型的“大牌”，从大到小；排在后面的都打不过前面的
+POWER_ORDER = (
+    CardPattern.PATTERN_ROCKET, CardPattern.PATTERN_FOUR_JOKER, CardPattern.PATTERN_HUGE_BOMB,
+    CardPattern.PATTERN_HUGE_TRIPLE, CardPattern.PATTERN_TRIPLE_JOKER, CardPattern.PATTERN_BIG_BOMB,
+    CardPattern.PATTERN_BIG_TRIPLE, CardPattern.PATTERN_DOUBLE_JOKER, CardPattern.PATTERN_BOMB,
+    CardPattern.PATTERN_TRIPLE,
+)
+# 王牌型同型相遇时后出的总能打过（现行规则如此），其余同型比大小
+JOKER_PATTERNS = {CardPattern.PATTERN_DOUBLE_JOKER, CardPattern.PATTERN_TRIPLE_JOKER, CardPattern.PATTERN_FOUR_JOKER}
+NORMAL_PATTERNS = (CardPattern.PATTERN_SINGLE, CardPattern.PATTERN_PAIR,
+                   CardPattern.PATTERN_DRAGON, CardPattern.PATTERN_DOUBLE_DRAGON)
+
+Beat = Callable[[Tuple[str, ...], Tuple[str, ...], int, int], bool]
+
+
+def _always(new: Tuple[str, ...], last: Tuple[str, ...], new_value: int, last_value: int) -> bool:
+    return True
+
+
+def _higher(new: Tuple[str, ...], last: Tuple[str, ...], new_value: int, last_value: int) -> bool:
+    return new_value > last_value
+
+
+def _higher_same_length(new: Tuple[str, ...], last: Tuple[str, ...], new_value: int, last_value: int) -> bool:
+    return new_value > last_value and len(new) == len(last)
+
+
+def _rocket_suited(new: Tuple[str, ...], last: Tuple[str, ...], new_value: int, last_value: int) -> bool:
+    return len({c[0] for c in new}) == 1 and len({c[0] for c in last}) > 1
+
+
+def _rocket_suit_order(new: Tuple[str, ...], last: Tuple[str, ...], new_value: int, last_value: int) -> bool:
+    new_suits, last_suits = {c[0] for c in new}, {c[0] for c in last}
+    if len(new_suits) > 1:
+        return False
+    if len(last_suits) > 1:
+        return True
+    return SUIT_ORDER.get(new[0][0], -1) > SUIT_ORDER.get(last[0][0], -1)
+
+
+def _rocket_none(new: Tuple[str, ...], last: Tuple[str, ...], new_value: int, last_value: int) -> bool:
+    return False
+
+
+ROCKET_BEATS: Dict[str, Beat] = {
+    ROCKET_SUITED: _rocket_suited, ROCKET_SUIT_ORDER: _rocket_suit_order, ROCKET_NONE: _rocket_none,
+}
+
+
+class RuleSpec:
+    """一种玩法的描述；缺省值就是现行规则"""
+
+    __slots__ = ('deck_count', 'max_players', 'disabled', 'rocket', 'triple_beats_double_dragon',
+                 'forks', 'chain_forks', 'first_card')
+
+    def __init__(self, deck_count: int = 1, max_players: int = 6, disabled: Any = (),
+                 rocket: str = ROCKET_SUITED, triple_beats_double_dragon: bool = False,
+                 forks: bool = True, chain_forks: Optional[bool] = None, first_card: str = '♥4') -> None:
+        self.deck_count = deck_count
+        self.max_players = max_players  # 房间最多几名玩家
+        self.disabled: FrozenSet[str] = frozenset(disabled)  # 关闭的可选牌型（单张不能关）
+        self.rocket = rocket  # 火箭之间怎么比
+        self.triple_beats_double_dragon = triple_beats_double_dragon  # 现行规则：炮不能打双龙
+        self.forks = forks  # 单张能不能被叉、勾
+        # 勾牌后能否继续叉；None 表示两副牌以上才能（现行规则）
+        self.chain_forks = deck_count >= 2 if chain_forks is None else chain_forks
+        self.first_card = first_card  # 拿到这张牌的玩家首出
+        self.validate()
+
+    def validate(self) -> None:
+        # 类型要严格：2.0 == 2、True == 1，混进来的话会和正常玩法共用缓存的规则表
+        for name in ('deck_count', 'max_players'):
+            if type(getattr(self, name)) is not int:
+                raise ValueError(f"{name} 必须是整数")
+        for name in ('triple_beats_double_dragon', 'forks', 'chain_forks'):
+            if type(getattr(self, name)) is not bool:
+                raise ValueError(f"{name} 必须是 true 或 false")
+        for name in ('rocket', 'first_card'):
+            if type(getattr(self, name)) is not str:
+                raise ValueError(f"{name} 必须是字符串")
+        if not all(type(name) is str for name in self.disabled):
+            raise ValueError("disabled 必须是牌型名称的列表")
+        if not 1 <= self.deck_count <= MAX_DECKS:
+            raise ValueError(f"牌副数必须在 1 到 {MAX_DECKS} 之间")
+        if not 2 <= self.max_players <= MAX_PLAYERS_LIMIT:
+            raise ValueError(f"人数上限必须在 2 到 {MAX_PLAYERS_LIMIT} 之间")
+        unknown = self.disabled - set(pattern_names(self.deck_count)) | (self.disabled & {CardPattern.PATTERN_SINGLE})
+        if unknown:
+            raise ValueError(f"不能关闭的牌型: {', '.join(sorted(unknown))}")
+        if self.rocket not in ROCKET_RULES:
+            raise ValueError(f"火箭规则必须是 {', '.join(ROCKET_RULES)} 之一")
+        if self.first_card not in CARD_VALUE:
+            raise ValueError(f"首出牌不存在: {self.first_card}")
+
+    def key(self) -> Tuple[Any, ...]:
+        """缓存键；各项已在 validate 中检查过类型，相等的键一定是同一种玩法"""
+        return (self.deck_count, self.max_players, tuple(sorted(self.disabled)), self.rocket,
+                self.triple_beats_double_dragon, self.forks, self.chain_forks, self.first_card)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['disabled'] = sorted(self.disabled)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'RuleSpec':
+        unknown = set(data) - set(cls.__slots__)
+        if unknown:
+            raise ValueError(f"未知的规则项: {', '.join(sorted(unknown))}")
+        try:
+            return cls(**data)
+        except TypeError as e:
+            raise ValueError(f"规则项格式不正确: {e}") from None
+
+    def __repr__(self) -> str:
+        return f"RuleSpec({self.to_dict()})"
+
+
+def pattern_names(deck_count: int) -> List[str]:
+    """该副数下可能出现的所有牌型"""
+    names = [SAME_KINDS[n][0] if n in SAME_KINDS else f'same_{n}' for n in range(1, max(8, 4 * deck_count) + 1)]
+    names += [JOKER_KINDS[n][0] if n in JOKER_KINDS else f'joker_{n}' for n in range(2, max(4, 2 * deck_count) + 1)]
+    return names + [CardPattern.PATTERN_ROCKET, CardPattern.PATTERN_DRAGON, CardPattern.PATTERN_DOUBLE_DRAGON]
+
+
+class RuleTables:
+    """编译好的规则：牌型识别和大小比较都是查表，结果按牌缓存"""
+
+    __slots__ = ('spec', 'deck_count', 'max_players', 'first_card', 'fork_size', 'chain_forks', 'standard',
+                 'same_kind', 'joker_kind', 'rocket', 'dragon', 'double_dragon', 'precedence',
+                 'power_patterns', 'pattern', 'beats')
+
+    def __init__(self, spec: RuleSpec) -> None:
+        self.spec = spec
+        self.deck_count = spec.deck_count
+        self.max_players = spec.max_players
+        self.first_card = spec.first_card
+        self.fork_size = 1 if spec.forks else 0  # 出这么多张时检查能否被叉（0 表示不能叉）
+        self.chain_forks = spec.chain_forks
+        self.standard = spec.key() == RuleSpec(deck_count=spec.deck_count).key()
+        enabled = set(pattern_names(spec.deck_count)) - spec.disabled
+
+        # 牌型识别表：下标是张数
+        self.same_kind: List[Optional[Tuple[str, int]]] = [None]
+        for n in range(1, max(8, 4 * spec.deck_count) + 1):
+            name, base = SAME_KINDS.get(n, (f'same_{n}', 1100 + 200 * (n - 8)))
+            self.same_kind.append((name, base) if name in enabled else None)
+        self.joker_kind: List[Optional[Tuple[str, int]]] = [None, None]
+        for n in range(2, max(4, 2 * spec.deck_count) + 1):
+            name, value = JOKER_KINDS.get(n, (f'joker_{n}', 1300 + 100 * (n - 4)))
+            self.joker_kind.append((name, value) if name in enabled else None)
+        self.rocket = CardPattern.PATTERN_ROCKET in enabled
+        self.dragon = CardPattern.PATTERN_DRAGON in enabled
+        self.double_dragon = CardPattern.PATTERN_DOUBLE_DRAGON in enabled
+
+        # 大小比较表：更多张的王和同点数牌排在同类最大牌型之上
+        extra_jokers = [k[0] for k in reversed(self.joker_kind[5:]) if k]
+        extra_same = [k[0] for k in reversed(self.same_kind[9:]) if k]
+        order = list(POWER_ORDER)
+        order[1:1] = extra_jokers
+        order[order.index(CardPattern.PATTERN_HUGE_BOMB):order.index(CardPattern.PATTERN_HUGE_BOMB)] = extra_same
+        jokers = JOKER_PATTERNS | set(extra_jokers)
+        self.precedence: Dict[Tuple[str, str], Beat] = {}
+        for i, new in enumerate(order):
+            for last in order[i + 1:] + list(NORMAL_PATTERNS) + [CardPattern.PATTERN_INVALID]:
+                self.precedence[new, last] = _always
+            if new == CardPattern.PATTERN_ROCKET:
+                self.precedence[new, new] = ROCKET_BEATS[spec.rocket]
+            else:
+                self.precedence[new, new] = _always if new in jokers else _higher
+        if not spec.triple_beats_double_dragon:
+            del self.precedence[CardPattern.PATTERN_TRIPLE, CardPattern.PATTERN_DOUBLE_DRAGON]
+        for name in NORMAL_PATTERNS:
+            dragon = name in (CardPattern.PATTERN_DRAGON, CardPattern.PATTERN_DOUBLE_DRAGON)
+            self.precedence[name, name] = _higher_same_length if dragon else _higher
+        self.power_patterns = frozenset(order) - {CardPattern.PATTERN_TRIPLE}  # 机器人舍不得拆的牌型
+
+        self.pattern = lru_cache(maxsize=CACHE_SIZE)(self._classify)
+        self.beats = lru_cache(maxsize=CACHE_SIZE)(self._beats)
+
+    def _classify(self, cards: Tuple[str, ...]) -> Tuple[Optional[str], int]:
+        n = len(cards)
+        if not n:
+            return None, 0
+        if n == 1:
+            return CardPattern.PATTERN_SINGLE, CardPattern.get_card_value(cards[0])
+        jokers = sum(1 for c in cards if '王' in c)
+        if jokers:
+            kind = self.joker_kind[n] if jokers == n and n < len(self.joker_kind) else None
+            return kind if kind else (CardPattern.PATTERN_INVALID, 0)
+        values = sorted(CARD_VALUE.get(c) or CardPattern.get_card_value(c) for c in cards)
+        low, high = values[0], values[-1]
+        if n == 3 and self.rocket and values == ROCKET_VALUES:
+            return CardPattern.PATTERN_ROCKET, 1500
+        if low == high:
+            kind = self.same_kind[n] if n < len(self.same_kind) else None
+            return (kind[0], kind[1] + low) if kind else (CardPattern.PATTERN_INVALID, 0)
+        if self.dragon and n >= 3 and high - low == n - 1 and len(set(values)) == n:
+            return CardPattern.PATTERN_DRAGON, high
+        if self.double_dragon and n >= 6 and n % 2 == 0 and values[0::2] == values[1::2] \
+                and high - low == n // 2 - 1 and len(set(values)) == n // 2:
+            return CardPattern.PATTERN_DOUBLE_DRAGON, high
+        return CardPattern.PATTERN_INVALID, 0
+
+    def _beats(self, new: Tuple[str, ...], last: Tuple[str, ...]) -> bool:
+        if not last:
+            return True
+        new_pattern, new_value = self.pattern(new)
+        last_pattern, last_value = self.pattern(last)
+        beat = self.precedence.get((new_pattern, last_pattern))
+        return beat is not None and beat(new, last, new_value, last_value)
+
+    def pattern_of(self, cards: List[str]) -> Tuple[Optional[str], int]:
+        return self.pattern(tuple(cards))
+
+    def can_beat(self, new_cards: List[str], last_cards: List[str]) -> bool:
+        return self.beats(tuple(new_cards), tuple(last_cards))
+
+    def clear_caches(self) -> None:
+        self.pattern.cache_clear()
+        self.beats.cache_clear()
+
+
+# 预设玩法；create_room 可以用名称，也可以传 {"base": 预设名, 规则项: 值, ...}
+VARIANTS: Dict[str, Dict[str, Any]] = {
+    'standard': {},
+    'three_decks': {'deck_count': 3, 'max_players': 9},
+    'four_decks': {'deck_count': 4, 'max_players': 12},
+    'no_rocket': {'disabled': [CardPattern.PATTERN_ROCKET]},
+    'suit_rockets': {'rocket': ROCKET_SUIT_ORDER},
+    'no_forks': {'forks': False},
+    'chain_forks': {'chain_forks': True},
+}
+
+_compiled: 'OrderedDict[Tuple[Any, ...], RuleTables]' = OrderedDict()
+
+
+def compile_rules(spec: RuleSpec) -> RuleTables:
+    """编译规则；同样的玩法共用一份表，最近用过的 MAX_COMPILED 套留在缓存里
+
+    被挤出缓存的规则表仍由使用它的房间持有，之后同样的玩法会重新编译一份。
+    """
+    key = spec.key()
+    tables = _compiled.get(key)
+    if tables is None:
+        tables = _compiled[key] = RuleTables(spec)
+        if len(_compiled) > MAX_COMPILED:
+            _compiled.popitem(last=False)
+    else:
+        _compiled.move_to_end(key)
+    return tables
+
+
+def resolve_variant(variant: Union[None, str, Dict[str, Any]] = None, deck_count: Optional[int] = None) -> RuleTables:
+    """把 create_room 里的 variant 解析成编译好的规则
+
+    预设或覆盖项里没有指定副数时，使用请求里的 deck_count。格式不对时抛出 ValueError。
+    """
+    overrides: Dict[str, Any] = {}
+    if isinstance(variant, dict):
+        overrides = dict(variant)
+        variant = overrides.pop('base', 'standard')
+    if variant is None:
+        variant = 'standard'
+    if variant not in VARIANTS:
+        raise ValueError(f"未知的玩法: {variant}")
+    fields: Dict[str, Any] = {'deck_count': deck_count} if deck_count is not None else {}
+    fields.update(VARIANTS[variant])
+    fields.update(overrides)
+    return compile_rules(RuleSpec.from_dict(fields))
+
+
+def standard_rules(deck_count: int = 1) -> RuleTables:
+    return compile_rules(RuleSpec(deck_count=deck_count))
+
+
+def clear_caches() -> None:
+    for tables in _compiled.values():
+        tables.clear_caches()
@@ -0,0 +1,201 @@
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import arrange
+import card_rules
+import executor
+from arrange import RANK_COUNT, Counts, Plan, solve_plan
+from card_rules import RULES_VERSION
+
+logger = logging.getLogger(__name__)
+
+# 规则快照：预先算好小手牌的最优拆牌（arrange._plan），写成一个只读文件。
+# 所有进程（主进程、模拟进程池）都用 mmap 映射同一个文件，内存页由操作系统共享，
+# 每个进程不用各自计算、各自缓存同样的结果。
+#
+# 文件：[文件头][拆牌表]
+#   文件头   MAGIC、格式版本、card_rules.RULES_VERSION、规则源码摘要、覆盖的最大张数、记录数
+#   拆牌表   张数合计不超过 PLAN_CARDS 的所有点数组合的 _plan 结果，按组合的序号（plan_index）排列
+# 规则版本或源码摘要与当前代码不一致时快照视为过期，不会被使用。
+#
+# 牌型识别表和大小比较表不放进快照：编译一套规则不到 1 毫秒，查 mmap 里的表也不比现算快。
+MAGIC = b'SPRS'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHI32sBI')
+
+PLAN_CARDS = 8  # 覆盖的最大手牌张数（约 20 万种组合，残局手牌都能直接查到）
+PLAN_RECORD = struct.Struct('<3B13H')  # 手数、单张数、火箭数，每个点数的决策各占 4 位
+
+SOURCES = (card_rules.__file__, arrange.__file__, __file__)  # 快照内容由这些源码决定
+
+DEFAULT_PATH = 'rules.snapshot'
+
+
+def fingerprint() -> bytes:
+    """规则相关源码的摘要；忘了改 RULES_VERSION 时也能发现快照过期"""
+    digest = hashlib.sha256()
+    for source in SOURCES:
+        with open(source, 'rb') as f:
+            digest.update(f.read())
+    return digest.digest()
+
+
+# _BINOM[n][k] = C(n, k)
+_BINOM = [[0] * (RANK_COUNT + 1) for _ in range(RANK_COUNT + PLAN_CARDS + 2)]
+for _n in range(len(_BINOM)):
+    _BINOM[_n][0] = 1
+    for _k in range(1, min(_n, RANK_COUNT) + 1):
+        _BINOM[_n][_k] = _BINOM[_n - 1][_k - 1] + (_BINOM[_n - 1][_k] if _k < _n else 0)
+PLAN_COUNT = _BINOM[RANK_COUNT + PLAN_CARDS][RANK_COUNT]  # 13 个点数、合计不超过 PLAN_CARDS 张的组合数
+
+
+def plan_index(counts: Counts) -> int:
+    """组合按字典序的序号；调用方保证张数合计不超过 PLAN_CARDS"""
+    index = 0
+    left = PLAN_CARDS
+    m = RANK_COUNT - 1
+    for c in counts:
+        if c:
+            # 这一位取 0..c-1、后面 m 位合计不超过剩余张数的组合都排在前面
+            index += _BINOM[m + left + 1][m + 1] - _BINOM[m + left - c + 1][m + 1]
+            left -= c
+        m -= 1
+    return index
+
+
+def all_counts(total: int, ranks: int = RANK_COUNT) -> Iterator[Counts]:
+    """ranks 个点数、合计正好 total 张的所有组合"""
+    if ranks == 0:
+        yield ()
+        return
+    for c in range(total + 1):
+        for rest in all_counts(total - c, ranks - 1):
+            yield (c,) + rest
+
+
+def pack_plan(plan: Plan) -> Tuple[int, ...]:
+    plays, singles, rockets, choices = plan
+    return (int(plays), singles, rockets, *(ca << 12 | cb << 8 | n1 << 4 | n2 for ca, cb, n1, n2 in choices))
+
+
+def unpack_plan(data: Any, offset: int) -> Plan:
+    plays, singles, rockets, *choices = PLAN_RECORD.unpack_from(data, offset)
+    return plays, singles, rockets, tuple((c >> 12, c >> 8 & 15, c >> 4 & 15, c & 15) for c in choices)
+
+
+class RulesSnapshot:
+    """只读映射的规则快照；文件格式不对或已过期时抛出 ValueError"""
+
+    __slots__ = ('path', 'plan_cards', '_mm')
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._mm) < HEADER.size or self._mm[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"不是规则快照: {path}")
+            _, fmt, version, digest, plan_cards, count = HEADER.unpack_from(self._mm, 0)
+            if fmt != FORMAT_VERSION or version != RULES_VERSION:
+                raise ValueError(f"规则快照已过期: 格式 {fmt}、规则版本 {version}，"
+                                 f"当前为 {FORMAT_VERSION}、{RULES_VERSION}")
+            if digest != fingerprint():
+                raise ValueError("规则快照已过期: 规则源码已修改")
+            if plan_cards != PLAN_CARDS or len(self._mm) != HEADER.size + count * PLAN_RECORD.size:
+                raise ValueError(f"规则快照不完整: {path}")
+        except (OSError, ValueError):  # 读源码算摘要也可能失败
+            self._mm.close()
+            raise
+        self.plan_cards = plan_cards
+
+    def plan(self, counts: Counts) -> Optional[Plan]:
+        """查表得到 arrange._plan 的结果；张数超出快照范围时返回 None"""
+        if sum(counts) > self.plan_cards:
+            return None
+        return unpack_plan(self._mm, HEADER.size + plan_index(counts) * PLAN_RECORD.size)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'path': self.path, 'bytes': len(self._mm), 'plan_cards': self.plan_cards,
+                'plans': (len(self._mm) - HEADER.size) // PLAN_RECORD.size}
+
+
+def build(path: str = DEFAULT_PATH) -> None:
+    """生成快照；先写临时文件再替换，正在映射旧文件的进程不受影响"""
+    started = time.perf_counter()
+    plans = bytearray(PLAN_COUNT * PLAN_RECORD.size)
+    for total in range(PLAN_CARDS + 1):
+        for counts in all_counts(total):
+            PLAN_RECORD.pack_into(plans, plan_index(counts) * PLAN_RECORD.size, *pack_plan(solve_plan(counts)))
+    # 每次生成用各自的临时文件，多个进程同时生成时不会写到同一个文件里
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, RULES_VERSION, fingerprint(), PLAN_CARDS, PLAN_COUNT))
+            f.write(plans)
+        os.chmod(tmp, 0o644)  # mkstemp 建的文件只有属主可读
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    logger.info("规则快照已生成 %s：%d 种拆牌，用时 %.1fs", path, PLAN_COUNT, time.perf_counter() - started)
+
+
+_installed: Optional[RulesSnapshot] = None
+
+
+def install(path: str = DEFAULT_PATH, rebuild: bool = True) -> Optional[RulesSnapshot]:
+    """映射快照，拆牌先查快照；快照缺失或过期时重新生成，rebuild=False 时只记录警告、照常现算
+
+    重新生成要 20 秒左右，服务器启动时用 rebuild=False，快照在部署时用 `python rules_snapshot.py build` 生成。
+    要在创建进程池之前调用：fork 出的工作进程直接继承映射，其它方式启动的工作进程由初始化函数映射同一个文件。
+    """
+    global _installed
+    try:
+        snapshot = RulesSnapshot(path)
+    except (OSError, ValueError) as e:
+        if not rebuild:
+            logger.warning("不使用规则快照 %s: %s", path, e)
+            return None
+        logger.info("重新生成规则快照 %s: %s", path, e)
+        build(path)
+        try:
+            snapshot = RulesSnapshot(path)
+        except (OSError, ValueError) as e:  # 刚生成的文件又被别的进程替换成了坏文件
+            logger.warning("不使用规则快照 %s: %s", path, e)
+            return None
+    arrange.share_plans(snapshot.plan)
+    _installed = snapshot
+    executor.add_worker_initializer(init_worker, path)
+    return snapshot
+
+
+def init_worker(path: str) -> None:
+    """进程池初始化函数：映射主进程已生成的快照，工作进程里不重新生成"""
+    if _installed is None or _installed.path != path:
+        install(path, rebuild=False)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    parser = argparse.ArgumentParser(description="生成或检查规则快照")
+    parser.add_argument('command', choices=('build', 'check'))
+    parser.add_argument('--path', default=os.environ.get('SILVERPOKER_RULES_SNAPSHOT', DEFAULT_PATH))
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build(args.path)
+    else:
+        try:
+            print(json.dumps(RulesSnapshot(args.path).stats(), ensure_ascii=False))
+        except (OSError, ValueError) as e:
+            print(e)
+            sys.exit(1)
@@ -1,18 +1,71 @@
+import asyncio
+import atexit
+import logging
+import os
+import time
+import tornado.escape
 import tornado.ioloop
 import tornado.web
 import tornado.websocket
 import json
-from collections import defaultdict
 import random
-from typing import List, Dict, Optional, Tuple, Any, Set
-from card_rules import CardPattern, Card
+from typing import List, Dict, Optional, Tuple, Any, Set, Callable
+from card_rules import CardPattern, Card, DECK, intern_cards
+from executor import RoomExecutor, IOLoopLagMonitor
+from bot import BotPlayer
+from arrange import arrange_groups
+from hand_index import HandAnalysis
+from gamelog import EVENT_FORK, EVENT_HOOK, EVENT_PLAY, GameLog
+from ledger import Ledger
+from lobby import Lobby
+from rule_variants import RuleTables, resolve_variant, standard_rules
+import rules_snapshot
+from spectate import Audience
+from metrics import ACTION_LATENCY, BROADCAST_BYTES, BROADCAST_FRAMES, CONNECTIONS, REGISTRY, Gauge, make_metrics_app
+from profiling import MemoryHandler, ProfileHandler, install_signal_handlers
+
+logger = logging.getLogger(__name__)
+
+# 记录耗时的 action，其他值统一记为 unknown，避免标签数量失控
+KNOWN_ACTIONS = {
+    'create_room', 'join_room', 'add_bot', 'start_game', 'play_cards', 'pass', 'auto_arrange',
+    'change_name', 'throw_brick', 'show_fire', 'list_rooms', 'quick_match', 'cancel_match', 'spectate',
+    'unspectate', 'identify', 'leaderboard', 'history',
+}
+
+MAX_PLAYERS = 6  # 标准玩法每个房间最多几名玩家（其他玩法见 RuleSpec.max_players）
+
+class Seat:
+    """一名玩家在房间里的状态：名称、手牌、累计得分，以及手牌的牌型索引和自动理牌结果"""
+    __slots__ = ('name', 'cards', 'score', 'hand_index', 'arranged')
+
+    def __init__(self, name: str = '') -> None:
+        self.name: str = name
+        self.cards: List[str] = []
+        self.score: int = 0
+        self.hand_index: Optional[HandAnalysis] = None  # 发牌后建立，出牌时同步更新
+        self.arranged: Optional[List[List[str]]] = None  # 自动理牌的结果，手牌变化时作废
 
 class GameRoom:
-    def __init__(self, deck_count: int = 1) -> None:
+    # 用 __slots__ 代替实例字典：单进程要承载十万级房间，每个房间都省下一个 __dict__
+    __slots__ = (
+        'players', 'current_player', 'cards', 'seats', 'game_started', 'last_cards', 'last_player',
+        'fork_enabled', 'hook_enabled', 'current_card', 'hook_player', 'waiting_for_fork', 'waiting_for_hook',
+        'passed_players', 'fork_player', 'deck_count', 'finished_order',
+        'is_giving_light', 'last_empty_player', '_executor', 'played_cards', 'state_version',
+        'auto_arrange_players', 'room_id', 'listener', 'audience', 'ledger',
+        'game_log', 'record', 'rules',
+    )
+
+    def __init__(self, deck_count: int = 1, room_id: Optional[str] = None, rules: Optional[RuleTables] = None) -> None:
+        # 编译好的玩法规则（不指定时为该副数的标准玩法），同一玩法的房间共用一份
+        self.rules: RuleTables = rules if rules is not None else standard_rules(deck_count)
+        deck_count = self.rules.deck_count
         self.players: List[tornado.websocket.WebSocketHandler] = []  # 玩家列表
         self.current_player: Optional[tornado.websocket.WebSocketHandler] = None  # 当前玩家
         self.cards: List[str] = []  # 牌堆
-        self.player_cards: Dict[tornado.websocket.WebSocketHandler, List[str]] = defaultdict(list)  # 玩家手牌
+        # 每名玩家的座位状态；中途离开的玩家保留到下一局开始，出牌记录里还会引用他们
+        self.seats: Dict[tornado.websocket.WebSocketHandler, Seat] = {}
         self.game_started: bool = False
         self.last_cards: List[str] = []  # 上一次出的牌
         self.last_player: Optional[tornado.websocket.WebSocketHandler] = None  # 上一个出牌的玩家
@@ -25,37 +78,131 @@ class GameRoom:
         self.passed_players: List[tornado.websocket.WebSocketHandler] = []  # 已经过牌的玩家
         self.fork_player: Optional[tornado.websocket.WebSocketHandler] = None  # 叉牌的玩家
         self.deck_count: int = deck_count  # 牌组数量
-        self.scores: Dict[tornado.websocket.WebSocketHandler, int] = defaultdict(int)  # 玩家分数
         self.finished_order: List[tornado.websocket.WebSocketHandler] = []  # 完成顺序
-        self.player_names: Dict[tornado.websocket.WebSocketHandler, str] = {}  # 玩家名称
         self.is_giving_light: bool = False  # 是否处于给光状态
         self.last_empty_player: Optional[tornado.websocket.WebSocketHandler] = None  # 最后一个出完牌的玩家
+        self._executor: Optional[RoomExecutor] = None  # 房间的后台任务队列，第一次提交任务时才创建
+        self.played_cards: List[str] = []  # 本局已公开打出的牌（含叉、勾）
+        self.state_version: int = 0  # 每次广播游戏状态时递增，用于识别过期的决策
+        self.auto_arrange_players: Set[tornado.websocket.WebSocketHandler] = set()  # 需要自动理牌的玩家
+        self.room_id: Optional[str] = room_id
+        self.listener: Optional[Callable[['GameRoom'], None]] = None  # 人数或开局状态变化时回调（大厅索引）
+        self.audience: Optional[Audience] = None  # 观战连接，第一个观众加入时才创建
+        self.ledger: Optional[Ledger] = None  # 持久化积分账本（模拟对局中为 None）
+        self.game_log: Optional[GameLog] = None  # 对局日志（模拟对局中为 None）
+        self.record: Optional[bytearray] = None  # 本局的对局日志缓冲区
         
     def add_player(self, player: tornado.websocket.WebSocketHandler) -> bool:
-        if len(self.players) < 6 and not self.game_started:
+        if len(self.players) < self.rules.max_players and not self.game_started:
             self.players.append(player)
             # 设置默认名称
-            self.player_names[player] = f"玩家{len(self.players)}"
+            self.seats[player] = Seat(f"玩家{len(self.players)}")
+            self.notify()
             return True
         return False
         
+    def player_id_taken(self, player_id: str, player: Optional[tornado.websocket.WebSocketHandler] = None) -> bool:
+        """除 player 以外是否已有玩家以 player_id 入座（身份未经验证，至少不让同一身份在一桌重复记分）"""
+        return any(getattr(p, 'player_id', None) == player_id for p in self.players if p is not player)
+        
     def set_player_name(self, player: tornado.websocket.WebSocketHandler, name: str) -> bool:
         """设置玩家名称"""
         if player in self.players and len(name.strip()) > 0:
-            self.player_names[player] = name.strip()
+            self.seats[player].name = name.strip()
             return True
         return False
         
+    def add_bot(self) -> bool:
+        """添加一个机器人玩家"""
+        bot = BotPlayer(self)
+        if not self.add_player(bot):
+            return False
+        bot_count = sum(1 for p in self.players if getattr(p, 'is_bot', False))
+        self.seats[bot].name = f"机器人{bot_count}"
+        return True
+        
+    def has_humans(self) -> bool:
+        """房间里是否还有真人玩家"""
+        return any(not getattr(p, 'is_bot', False) for p in self.players)
+        
+    def set_auto_arrange(self, player: tornado.websocket.WebSocketHandler, enabled: bool) -> bool:
+        """开启或关闭自动理牌（game_state 中附带 arranged_groups）"""
+        if player not in self.players:
+            return False
+        if enabled:
+            self.auto_arrange_players.add(player)
+        else:
+            self.auto_arrange_players.discard(player)
+        return True
+        
     def remove_player(self, player: tornado.websocket.WebSocketHandler) -> None:
         if player in self.players:
             self.players.remove(player)
+        self.auto_arrange_players.discard(player)
+        self.notify()
+        
+    def add_spectator(self, watcher: tornado.websocket.WebSocketHandler) -> None:
+        """观战：不占座位，只收到隐藏手牌的公开状态"""
+        if self.audience is None:
+            self.audience = Audience()
+        self.audience.add(watcher)
+        
+    def remove_spectator(self, watcher: tornado.websocket.WebSocketHandler) -> None:
+        if self.audience is not None:
+            self.audience.remove(watcher)
+            
+    def broadcast_event(self, message: Dict[str, Any]) -> None:
+        """发给所有玩家和观众的公开消息（房间状态、游戏结束、互动特效）"""
+        for player in self.players:
+            self.send(player, message)
+        if self.audience is not None:
+            self.audience.event(message)
+            
+    def notify(self) -> None:
+        """通知大厅房间的人数或开局状态变了"""
+        if self.listener is not None:
+            self.listener(self)
             
+    def send(self, player: tornado.websocket.WebSocketHandler, message: Dict[str, Any]) -> None:
+        """给玩家发送消息，并统计广播条数和字节数"""
+        if getattr(player, 'is_bot', False):
+            player.write_message(message)
+            return
+        text = tornado.escape.json_encode(message)
+        BROADCAST_FRAMES.inc(1, message['action'])
+        BROADCAST_BYTES.inc(len(text.encode('utf-8')), message['action'])
+        player.write_message(text)
+        
+    @property
+    def executor(self) -> RoomExecutor:
+        if self._executor is None:
+            self._executor = RoomExecutor()
+        return self._executor
+        
+    def submit_task(self, fn: Callable[..., Any], *args: Any, use_process: bool = True) -> asyncio.Future:
+        """把CPU密集型任务提交到进程池（或线程池），按房间内提交顺序执行，结果在IOLoop上返回"""
+        return self.executor.submit(fn, *args, use_process=use_process)
+        
+    def close(self) -> None:
+        """房间结束时取消所有后台任务，通知观众"""
+        if self._executor is not None:  # 没提交过任务的房间不必为了取消再创建队列
+            self._executor.cancel_all()
+        if self.audience is not None:
+            watchers = list(self.audience.watchers)
+            self.audience.close()
+            # 观众收到 room_closed 后可以去看别的房间
+            for watcher in watchers:
+                if getattr(watcher, 'spectating', None) == self.room_id:
+                    del watcher.spectating
+        
     def start_game(self) -> bool:
         if len(self.players) >= 2:
             # 重置游戏状态
             self.current_player = None
             self.cards = []
-            self.player_cards = defaultdict(list)
+            self.seats = {p: self.seats[p] for p in self.players}
+            for seat in self.seats.values():
+                seat.cards = []
             self.last_cards = []
             self.last_player = None
             self.fork_enabled = False
@@ -69,44 +216,40 @@ class GameRoom:
             self.is_giving_light = False
             self.last_empty_player = None
             self.finished_order = []
+            self.played_cards = []
 
             # 先广播致谢消息给所有玩家
             for player in self.players:
-                player.write_message({
+                self.send(player, {
                     'action': 'show_thanks',
                     'message': '六六让我致谢：感谢银姐及其爱人帮助测试bug 银姐祝各位玩家牌运🤙🤙🤙'
                 })
             
             self.game_started = True
+            self.notify()
             self.init_cards()
             self.deal_cards()
-            # 找到有红心4的玩家作为首家
+            # 找到有首出牌（标准玩法为红心4）的玩家作为首家
             for player in self.players:
-                if '♥4' in self.player_cards[player]:
+                if self.rules.first_card in self.seats[player].cards:
                     self.current_player = player
                     break
+            if self.game_log is not None:
+                first = self.players.index(self.current_player) if self.current_player else 0
+                self.record = self.game_log.begin(self.rules.spec, len(self.players), first)
             return True
         return False
             
     def init_cards(self) -> None:
         """初始化牌组"""
         # 初始化一副或两副牌
-        all_cards = []
-        for _ in range(self.deck_count):
-            # 生成一副牌
-            deck = []
-            # 生成普通牌
-            for suit in ['♠', '♥', '♣', '♦']:
-                for rank in ['3', '2', 'A', 'K', 'Q', 'J', '10', '9', '8', '7', '6', '5', '4']:
-                    deck.append(suit + rank)
-            # 添加大小王
-            deck.extend(['大王', '小王'])
-            all_cards.extend(deck)
+        # 直接引用 DECK 中的牌，不为每个房间重新生成字符串
+        all_cards = list(DECK) * self.deck_count
             
         # 洗牌
         random.shuffle(all_cards)
         self.cards = all_cards
-        print(f"初始化了 {len(self.cards)} 张牌")
+        logger.debug("初始化了 %d 张牌", len(self.cards))
         
     def deal_cards(self) -> None:
         """发牌"""
@@ -120,15 +263,15 @@ class GameRoom:
             # 计算这个玩家应得的牌数
             cards_for_this_player = base_cards + (1 if i < remaining_cards else 0)
             # 从当前位置取相应数量的牌
-            self.player_cards[player] = self.cards[current_pos:current_pos + cards_for_this_player]
+            self.seats[player].cards = self.cards[current_pos:current_pos + cards_for_this_player]
             current_pos += cards_for_this_player
             # 对玩家手牌排序
-            self.player_cards[player] = [str(c) for c in CardPattern.sort_cards(self.player_cards[player])]
+            self.seats[player].cards = [str(c) for c in CardPattern.sort_cards(self.seats[player].cards)]
             
             # 识别所有火箭组合（两个4和一个A）
             all_rockets = []  # 存储所有找到的火箭组合
-            fours = [card for card in self.player_cards[player] if card.endswith('4')]
-            aces = [card for card in self.player_cards[player] if card.endswith('A')]
+            fours = [card for card in self.seats[player].cards if card.endswith('4')]
+            aces = [card for card in self.seats[player].cards if card.endswith('A')]
             
             # 尽可能多地组合火箭
             while len(fours) >= 2 and len(aces) >= 1:
@@ -143,24 +286,26 @@ class GameRoom:
                 # 从原手牌中移除所有火箭牌
                 for rocket in all_rockets:
                     for card in rocket:
-                        self.player_cards[player].remove(card)
+                        self.seats[player].cards.remove(card)
                 
                 # 找到大王的位置（如果有的话）
                 joker_index = -1
-                for i, card in enumerate(self.player_cards[player]):
+                for i, card in enumerate(self.seats[player].cards):
                     if card in ['大王', '小王']:
                         joker_index = i
                         # break
                 
                 # 将所有火箭牌按顺序插入到大王后面或列表末尾
-                insert_pos = joker_index + 1 if joker_index != -1 else len(self.player_cards[player])
+                insert_pos = joker_index + 1 if joker_index != -1 else len(self.seats[player].cards)
                 for rocket in all_rockets:
-                    self.player_cards[player][insert_pos:insert_pos] = rocket
+                    self.seats[player].cards[insert_pos:insert_pos] = rocket
                     insert_pos += 3  # 每个火箭有3张牌
+        self.cards = []  # 牌已经全部发完
+        self.index_hands()
             
     def play_cards(self, player: tornado.websocket.WebSocketHandler, cards: List[str]) -> Tuple[bool, str]:
         """玩家出牌"""
-        print(f'play_cards: {player}, {cards}')
+        logger.debug("play_cards: %s, %s", player, cards)
         if not self.game_started:
             return False, "游戏还没开始"
             
@@ -171,6 +316,8 @@ class GameRoom:
                 # 叉牌时不检查是否轮到该玩家
                 if player == self.current_player:
                     return False, "当前玩家不能叉自己的牌"
+                if player == self.hook_player:
+                    return False, "勾牌玩家不能叉自己的牌"
                 if not (cards[0][1:] == cards[1][1:] == self.current_card[1:]):
                     return False, "叉牌必须是相同点数的对子"
                 self.fork_enabled = False
@@ -179,9 +326,15 @@ class GameRoom:
                 self.current_card = cards[0]
                 self.fork_player = player
                 self.hook_player = None  # 清空勾牌玩家
-                for card in cards:
-                    self.player_cards[player].remove(card)
+                self.take_cards(player, cards)
                 self.passed_players.clear()  # 清空过牌记录
+                # 没有人需要表态（其他人都没牌了，出牌玩家也勾不了）时直接结束勾牌阶段
+                if not any(self.seats[p].cards for p in self.players if p not in (self.current_player, player)) \
+                        and not CardPattern.can_hook(self.current_card, self.seats[self.current_player].cards):
+                    self.waiting_for_hook = False
+                    self.hook_enabled = False
+                    self.give_lead(player)
+                    return True, "叉牌成功，现在可以出任意牌"
                 return True, "叉牌成功，等待其他玩家勾牌"
             
             # 处理勾牌
@@ -195,15 +348,17 @@ class GameRoom:
                 self.waiting_for_hook = False
                 self.current_card = cards[0]
                 self.hook_player = player
-                self.player_cards[player].remove(cards[0])
+                self.take_cards(player, cards)
                 self.passed_players.clear()  # 清空过牌记录
                 
-                # 如果是2副牌，勾牌后可以继续叉牌
-                if self.deck_count == 2:
+                # 多副牌的玩法（标准玩法为2副牌），勾牌后可以继续叉牌
+                if self.rules.chain_forks:
                     # 检查是否有玩家可以叉牌
                     can_fork = False
                     for p in self.players:
-                        if p != player and len(self.player_cards[p]) > 0 and self.can_fork(cards[0], self.player_cards[p]):
+                        # 当前出牌玩家不能叉（见上面的叉牌检查），不算能叉的玩家
+                        if p != player and p != self.current_player and len(self.seats[p].cards) > 0 \
+                                and self.can_fork(cards[0], self.seats[p].cards):
                             can_fork = True
                             break
                     
@@ -214,11 +369,9 @@ class GameRoom:
                     
                 # 如果没有人可以叉牌，或者是1副牌，勾牌的玩家成为最大
                 self.fork_enabled = False  # 确保关闭叉牌状态
-                self.last_cards = []  # 清空上一手牌，允许出任意牌
-                self.last_player = player  # 勾牌的玩家成为最大
-                self.current_player = player  # 轮到勾牌玩家出牌
                 self.current_card = None
                 self.hook_player = None  # 清空勾牌玩家
+                self.give_lead(player)  # 轮到勾牌玩家出任意牌
                 return True, "勾牌成功，现在可以出任意牌"
                 
             # 在等待叉牌或勾牌时，不允许其他出牌操作
@@ -232,7 +385,7 @@ class GameRoom:
             return False, "请选择要出的牌"
             
         # 检查玩家是否有这些牌
-        if not all(card in self.player_cards[player] for card in cards):
+        if not all(card in self.seats[player].cards for card in cards):
             return False, "你没有这些牌"
             
         # 如果是新的一轮（没有上一手牌），或者是上一个出牌的玩家，清空过牌记录
@@ -240,20 +393,20 @@ class GameRoom:
             self.passed_players.clear()
             
         # 检查出牌是否符合规则
-        print(f"last_cards: {self.last_cards}, cards: {cards}")
+        logger.debug("last_cards: %s, cards: %s", self.last_cards, cards)
         
         # 在给光状态下，不需要检查是否能打过上一手牌
         if not self.is_giving_light:
-            pattern = CardPattern.get_pattern(cards)
+            # 牌型识别和比较都查玩法编译好的表
+            pattern = self.rules.pattern_of(cards)
             if pattern[0] == CardPattern.PATTERN_INVALID:
                 return False, "出牌不符合规则"
             
-            if not CardPattern.can_beat(cards, self.last_cards):
+            if not self.rules.can_beat(cards, self.last_cards):
                 return False, "出牌不符合规则"
             
         # 出牌符合规则，先移除这些牌
-        for card in cards:
-            self.player_cards[player].remove(card)
+        self.take_cards(player, cards)
             
         # 出牌成功时，如果玩家在passed_players中，将其移除
         if player in self.passed_players:
@@ -263,12 +416,12 @@ class GameRoom:
         self.last_cards = cards
         self.last_player = player
         
-        # 检查是否可以叉牌（只有出单张时才能叉牌）
-        if len(cards) == 1:
+        # 检查是否可以叉牌（只有出单张时才能叉牌；不能叉的玩法 fork_size 为 0）
+        if len(cards) == self.rules.fork_size:
             can_fork = False
             # 检查其他玩家是否可以叉牌
             for p in self.players:
-                if p != player and len(self.player_cards[p]) > 0 and self.can_fork(cards[0], self.player_cards[p]):
+                if p != player and len(self.seats[p].cards) > 0 and self.can_fork(cards[0], self.seats[p].cards):
                     can_fork = True
                     break
                     
@@ -276,23 +429,21 @@ class GameRoom:
                 self.fork_enabled = True
                 self.current_card = cards[0]
                 self.is_giving_light = False  # 一旦有人出牌且可以被叉，给光状态就结束
+                self.fork_player = None  # 上一次叉勾的记录不能影响这次谁能叉
+                self.hook_player = None
+                # 叉牌阶段每个人重新表态：之前普通过牌的记录留着的话，这些玩家既不会被要求表态，
+                # 再过牌也不算数，叉牌阶段就永远结束不了
+                self.passed_players.clear()
                 return True, "出牌成功，等待其他玩家叉牌"
             
         # 检查玩家是否已经出完牌（移到这里，确保在叉牌检查之后）
-        if not self.player_cards[player]:
-            # 记录完成顺序
-            if player not in self.finished_order:
-                self.finished_order.append(player)
-                self.last_empty_player = player  # 记录最后一个出完牌的玩家
+        if not self.seats[player].cards:
+            # 完成顺序在 take_cards 中记录
+            self.last_empty_player = player  # 记录最后一个出完牌的玩家
             
             # 检查是否只剩最后一个玩家有牌
-            players_with_cards = [p for p in self.players if len(self.player_cards[p]) > 0]
+            players_with_cards = [p for p in self.players if len(self.seats[p].cards) > 0]
             if len(players_with_cards) <= 1:
-                # 如果最后一个玩家也出完了牌，确保他也被加入到完成顺序中
-                if len(players_with_cards) == 0:
-                    last_player = [p for p in self.players if p not in self.finished_order][0]
-                    if last_player not in self.finished_order:
-                        self.finished_order.append(last_player)
                 return True, "游戏结束，玩家胜利！"
             
             # 如果没有人可以叉牌，轮到下一个玩家
@@ -307,6 +458,42 @@ class GameRoom:
         self.next_player()
         return True, "出牌成功"
 
+    def take_cards(self, player: tornado.websocket.WebSocketHandler, cards: List[str]) -> None:
+        """从玩家手牌中移除打出的牌，同步更新牌型索引"""
+        for card in cards:
+            self.seats[player].cards.remove(card)
+        self.played_cards.extend(cards)
+        seat = self.seats[player]
+        if seat.hand_index is not None:
+            seat.hand_index.remove(cards)
+        seat.arranged = None
+        # 出完牌就记录完成顺序，叉、勾出完的也一样
+        if not self.seats[player].cards and player not in self.finished_order:
+            self.finished_order.append(player)
+            
+    def give_lead(self, player: tornado.websocket.WebSocketHandler) -> None:
+        """叉勾结束后 player 成为最大、出任意牌；player 已经出完牌时由下一个有牌的玩家出"""
+        self.last_cards = []
+        self.last_player = player
+        self.current_player = player
+        self.passed_players.clear()
+        if not self.seats[player].cards:
+            self.next_player()
+            
+    def index_hands(self) -> None:
+        """为所有玩家的手牌建立牌型索引（新发的牌，旧的理牌结果一并作废）"""
+        for p in self.players:
+            seat = self.seats[p]
+            seat.hand_index = HandAnalysis(seat.cards)
+            seat.arranged = None
+        
+    def can_beat_last(self, player: tornado.websocket.WebSocketHandler) -> bool:
+        """玩家手里有没有能打过上一手的牌（用于自动过牌和提示）"""
+        seat = self.seats[player]
+        if seat.hand_index is None:
+            seat.hand_index = HandAnalysis(seat.cards)
+        return seat.hand_index.can_beat(self.last_cards, self.rules.beats)
+        
     def can_fork(self, card: str, player_cards: List[str]) -> bool:
         """检查玩家是否可以叉牌"""
         # 统计玩家手牌中相同点数的牌的数量
@@ -327,30 +514,31 @@ class GameRoom:
                     # 自动将无牌可叉或没有手牌的玩家加入过牌列表
                     for p in other_players:
                         if p not in self.passed_players and (
-                            len(self.player_cards[p]) == 0 or  # 没有手牌
-                            not self.can_fork(self.current_card, self.player_cards[p])  # 无牌可叉
+                            len(self.seats[p].cards) == 0 or  # 没有手牌
+                            not self.can_fork(self.current_card, self.seats[p].cards)  # 无牌可叉
                         ):
                             self.passed_players.append(p)
                     
                     # 在叉牌阶段，只有所有其他玩家都放弃叉牌权利时，才进入下一阶段
-                    # 只考虑还有手牌的玩家
-                    active_players = [p for p in other_players if len(self.player_cards[p]) > 0]
+                    # 只考虑还有手牌的玩家；勾牌后继续叉时，勾牌玩家不能叉自己的牌
+                    active_players = [p for p in other_players if len(self.seats[p].cards) > 0 and p != self.hook_player]
                     all_passed = all(p in self.passed_players for p in active_players)
                     if all_passed:
                         # 所有玩家都放弃叉牌，结束叉牌阶段
                         self.fork_enabled = False
                         self.current_card = None
+                        if self.hook_player is not None:
+                            # 勾牌后没人继续叉：和没法继续叉时一样，勾牌的玩家成为最大
+                            hook_player, self.hook_player = self.hook_player, None
+                            self.give_lead(hook_player)
+                            return True, "放弃叉勾权利"
                         
                         # 检查当前玩家是否已经出完牌
-                        if len(self.player_cards[self.current_player]) == 0:
+                        if len(self.seats[self.current_player].cards) == 0:
                             # 如果当前玩家已经出完牌，检查是否游戏结束
-                            players_with_cards = [p for p in self.players if len(self.player_cards[p]) > 0]
+                            players_with_cards = [p for p in self.players if len(self.seats[p].cards) > 0]
                             if len(players_with_cards) <= 1:
-                                # 游戏结束
-                                if len(players_with_cards) == 0:
-                                    last_player = [p for p in self.players if p not in self.finished_order][0]
-                                    if last_player not in self.finished_order:
-                                        self.finished_order.append(last_player)
+                                # 游戏结束（完成顺序已在 take_cards 中记录）
                                 return True, "游戏结束"
                         
                         self.next_player()
@@ -360,16 +548,14 @@ class GameRoom:
                             return True, "给光状态：可以自由出牌"
                 else:  # waiting_for_hook
                     # 在勾牌阶段，除了叉牌玩家外的所有玩家都需要表态
-                    other_players = [p for p in other_players if p != self.fork_player and len(self.player_cards[p]) > 0]
+                    other_players = [p for p in other_players if p != self.fork_player and len(self.seats[p].cards) > 0]
                     all_passed = all(p in self.passed_players for p in other_players)
                     if all_passed:
-                        # 所有玩家都放弃勾牌，轮到叉牌玩家出牌
+                        # 所有玩家都放弃勾牌，轮到叉牌玩家出任意牌
                         self.waiting_for_hook = False
                         self.hook_enabled = False
-                        self.current_player = self.fork_player
-                        self.last_cards = []  # 清空上一手牌，允许出任意牌
                         self.hook_player = None  # 清空勾牌玩家
-                        self.passed_players.clear()
+                        self.give_lead(self.fork_player)
             # 叉勾阶段的过牌不会立即轮到下家，只是记录放弃权利
             return True, "放弃叉勾权利"
             
@@ -390,13 +576,13 @@ class GameRoom:
         # 检查是否进入给光状态
         if self.last_empty_player:
             # 获取还有手牌的玩家
-            players_with_cards = [p for p in self.players if len(self.player_cards[p]) > 0]
+            players_with_cards = [p for p in self.players if len(self.seats[p].cards) > 0]
             # 如果只剩最后一个玩家有牌，不进入给光状态
             if len(players_with_cards) == 1:
                 # 直接结束游戏
                 return True, "游戏结束"
             
-            other_players = [p for p in self.players if p != self.last_empty_player and len(self.player_cards[p]) > 0]
+            other_players = [p for p in self.players if p != self.last_empty_player and len(self.seats[p].cards) > 0]
             if all(p in self.passed_players for p in other_players):
                 # 进入给光状态
                 self.is_giving_light = True
@@ -408,9 +594,7 @@ class GameRoom:
         # 如果所有其他玩家都过牌了，轮到最后出牌的玩家
         other_players = [p for p in self.players if p != self.last_player]
         if all(p in self.passed_players for p in other_players):
-            self.current_player = self.last_player
-            self.last_cards = []  # 清空上一手牌，允许出任意牌
-            self.passed_players.clear()
+            self.give_lead(self.last_player)  # 清空上一手牌，允许出任意牌
             
         return True, "过牌成功"
         
@@ -428,7 +612,7 @@ class GameRoom:
                 self.last_cards = []
                 break
             # 如果找到一个还有牌的玩家，就选择他
-            if len(self.player_cards[self.players[next_index]]) > 0:
+            if len(self.seats[self.players[next_index]].cards) > 0:
                 self.current_player = self.players[next_index]
                 break
             # 如果这个玩家已经出完牌了，自动将他加入过牌列表
@@ -443,7 +627,7 @@ class GameRoom:
     def check_game_over(self) -> Tuple[bool, Optional[List[tornado.websocket.WebSocketHandler]]]:
         """检查游戏是否结束"""
         # 统计还有手牌的玩家
-        players_with_cards = [p for p in self.players if len(self.player_cards[p]) > 0]
+        players_with_cards = [p for p in self.players if len(self.seats[p].cards) > 0]
         # 如果只剩一个玩家有牌，或者只剩最后一个玩家有牌，游戏结束
         if len(players_with_cards) <= 1:
             # 找到失败者（最后一个还有牌的玩家）
@@ -454,73 +638,177 @@ class GameRoom:
                 loser = players_with_cards[0]
             
             # 扣分：剩余手牌数（如果是刚出完的玩家，扣0分）
-            self.scores[loser] -= len(self.player_cards[loser])
+            self.seats[loser].score -= len(self.seats[loser].cards)
             
             # 加分：按照完成顺序
             n = len(self.players)
             for i, player in enumerate(self.finished_order):
-                self.scores[player] += (n - i - 1)
+                self.seats[player].score += (n - i - 1)
             
             # 标记游戏结束，但保留状态
             self.game_started = False
+            self.notify()
             
             return True, [p for p in self.players if p != loser]
         return False, None
 
     def broadcast_game_state(self) -> None:
         """广播游戏状态给所有玩家"""
+        self.state_version += 1
+        index = {p: i for i, p in enumerate(self.players)}
+        public = self.public_state(index)
         for player in self.players:
-            # 构建上一手牌的显示信息
-            last_cards_info = None
-            if self.last_cards:
-                last_player_name = self.player_names[self.last_player] if self.last_player else None
-                last_cards_info = {
-                    'cards': self.last_cards,
-                    'player_name': last_player_name
-                }
-            
-            # 构建叉牌信息
-            fork_info = None
-            if self.fork_player and not self.hook_player and not self.waiting_for_hook:
-                fork_info = {
-                    'cards': [self.current_card] * 2,
-                    'player_name': self.player_names[self.fork_player]
-                }
-            
-            # 构建勾牌信息
-            hook_info = None
-            if self.hook_player and not self.waiting_for_hook:
-                hook_info = {
-                    'cards': [self.current_card],
-                    'player_name': self.player_names[self.hook_player]
-                }
-            
-            player.write_message({
+            seat = self.seats[player]
+            hand = seat.cards
+            state = {
                 'action': 'game_state',
-                'cards': self.player_cards[player],
+                'cards': hand,
                 'current_player': player == self.current_player,
-                'last_cards': last_cards_info,
-                'fork_info': fork_info,
-                'hook_info': hook_info,
-                'last_player': self.players.index(self.last_player) if self.last_player else None,
-                'last_player_name': self.player_names[self.last_player] if self.last_player else None,
-                'player_card_counts': {self.players.index(p): len(self.player_cards[p]) for p in self.players},
-                'can_fork': self.fork_enabled and CardPattern.can_fork(self.current_card, self.player_cards[player]) if self.current_card else False,
-                'can_hook': self.hook_enabled and CardPattern.can_hook(self.current_card, self.player_cards[player]) if self.current_card else False,
-                'waiting_for_hook': self.waiting_for_hook,
-                'passed_players': [self.players.index(p) for p in self.passed_players],
-                'player_number': self.players.index(player),
-                'scores': {self.players.index(p): self.scores[p] for p in self.players},
-                'player_names': {self.players.index(p): self.player_names[p] for p in self.players},
-                'can_pass': True,  # 始终允许玩家选择过牌
-                'fork_player': self.players.index(self.fork_player) if self.fork_player else None,
-                'hook_player': self.players.index(self.hook_player) if self.hook_player else None,
-                'is_giving_light': self.is_giving_light  # 添加给光状态
-            })
+                'can_fork': self.fork_enabled and CardPattern.can_fork(self.current_card, hand) if self.current_card else False,
+                'can_hook': self.hook_enabled and CardPattern.can_hook(self.current_card, hand) if self.current_card else False,
+                'player_number': index[player],
+                **public,
+            }
+            # 自动理牌：按最少出牌手数拆好的牌组，每手牌只算一次（大手牌要几毫秒，不能每次广播都重算）
+            if player in self.auto_arrange_players:
+                if seat.arranged is None:
+                    seat.arranged = arrange_groups(hand, self.rules)
+                state['arranged_groups'] = seat.arranged
+            self.send(player, state)
+        if self.audience:  # 没有观众时不构建观战状态
+            self.audience.publish(self.spectator_state(index, public))
+            
+    def public_state(self, index: Dict[Any, int]) -> Dict[str, Any]:
+        """所有玩家和观众都能看到的公共状态
+
+        每次广播只构建一次，各玩家的消息共享这些对象（发送时立即编码，不会被修改）。
+        """
+        # 构建上一手牌的显示信息
+        last_cards_info = None
+        if self.last_cards:
+            last_player_name = self.seats[self.last_player].name if self.last_player else None
+            last_cards_info = {
+                'cards': self.last_cards,
+                'player_name': last_player_name
+            }
+        
+        # 构建叉牌信息
+        fork_info = None
+        if self.fork_player and not self.hook_player and not self.waiting_for_hook:
+            fork_info = {
+                'cards': [self.current_card] * 2,
+                'player_name': self.seats[self.fork_player].name
+            }
+        
+        # 构建勾牌信息
+        hook_info = None
+        if self.hook_player and not self.waiting_for_hook:
+            hook_info = {
+                'cards': [self.current_card],
+                'player_name': self.seats[self.hook_player].name
+            }
+        
+        return {
+            'last_cards': last_cards_info,
+            'fork_info': fork_info,
+            'hook_info': hook_info,
+            'last_player': index.get(self.last_player) if self.last_player else None,
+            'last_player_name': self.seats[self.last_player].name if self.last_player else None,
+            'player_card_counts': {i: len(self.seats[p].cards) for p, i in index.items()},
+            'waiting_for_hook': self.waiting_for_hook,
+            'passed_players': [index[p] for p in self.passed_players],
+            'scores': {i: self.seats[p].score for p, i in index.items()},
+            'player_names': {i: self.seats[p].name for p, i in index.items()},
+            'can_pass': True,  # 始终允许玩家选择过牌
+            'fork_player': index.get(self.fork_player) if self.fork_player else None,
+            'hook_player': index.get(self.hook_player) if self.hook_player else None,
+            'is_giving_light': self.is_giving_light  # 添加给光状态
+        }
+
+    def spectator_state(self, index: Dict[Any, int], public: Dict[str, Any]) -> Dict[str, Any]:
+        """观众看到的状态：只有公开信息，手牌只给张数"""
+        return {
+            'action': 'spectator_state',
+            'game_started': self.game_started,
+            'current_player': index.get(self.current_player) if self.current_player else None,
+            'spectators': len(self.audience),
+            **public,
+        }
+
+    def broadcast_game_over(self, winners: List[tornado.websocket.WebSocketHandler]) -> None:
+        """广播游戏结束"""
+        loser = [p for p in self.players if p not in winners][0]
+        results = dict(zip(self.players, self.game_results(winners)))
+        # 所有人收到的内容相同，观众也一起发
+        self.broadcast_event({
+            'action': 'game_over',
+            'winners': [self.players.index(p) for p in winners],
+            'loser': self.players.index(loser),
+            'scores': {
+                'winners': [(self.players.index(p), self.seats[p].score, results[p][1]) for p in winners],
+                'loser': (self.players.index(loser), self.seats[loser].score, -len(self.seats[loser].cards))
+            },
+            'player_names': {self.players.index(p): self.seats[p].name for p in self.players}
+        })
+
+    def handle_play(self, player: tornado.websocket.WebSocketHandler, cards: List[str]) -> Tuple[bool, str]:
+        """处理玩家出牌（包括叉、勾），并检查游戏是否结束"""
+        # 与 play_cards 的分支一致：叉勾阶段两张是叉、一张是勾
+        kind = EVENT_PLAY
+        if self.fork_enabled or self.waiting_for_hook:
+            if self.fork_enabled and len(cards) == 2:
+                kind = EVENT_FORK
+            elif self.hook_enabled and len(cards) == 1:
+                kind = EVENT_HOOK
+        success, message = self.play_cards(player, cards)
+        if success and self.record is not None:
+            self.game_log.add_cards(self.record, kind, self.players.index(player), cards)
+        if success:
+            # 先检查游戏是否结束
+            self.broadcast_game_state()
+            game_over, winners = self.check_game_over()
+            logger.debug("game_over: %s, winners: %s", game_over, winners)
+            if game_over:
+                # 先广播游戏结束消息
+                self.broadcast_game_over(winners)
+                if self.ledger is not None:
+                    self.record_result(winners)
+                if self.record is not None:
+                    self.game_log.finish(self.record, self.game_results(winners))
+                    self.record = None
+            # 然后再广播最终的游戏状态
+            self.broadcast_game_state()
+        return success, message
+
+    def record_result(self, winners: List[tornado.websocket.WebSocketHandler]) -> None:
+        """把本局结果交给积分账本（只记录表明了身份的真人玩家，写入在后台线程完成）"""
+        results = []
+        seen = set()
+        for player, (position, score) in zip(self.players, self.game_results(winners)):
+            player_id = getattr(player, 'player_id', None)
+            if player_id is not None and player_id not in seen:  # 快速匹配可能凑到同一身份，只记一次
+                seen.add(player_id)
+                results.append((player_id, self.seats[player].name, position, score))
+        self.ledger.record_game(self.room_id, len(self.players), results)
+        
+    def game_results(self, winners: List[tornado.websocket.WebSocketHandler]) -> List[Tuple[int, int]]:
+        """按座位顺序返回本局每名玩家的 (名次, 得分)，名次从 0 开始"""
+        n = len(self.players)
+        results = []
+        for player in self.players:
+            if player in winners:
+                # 出完牌的都在完成顺序里；万一不在（状态异常），排在已完成的玩家之后，不让广播和记分出错
+                position = self.finished_order.index(player) if player in self.finished_order else len(self.finished_order)
+                results.append((position, n - position - 1))
+            else:
+                results.append((n - 1, -len(self.seats[player].cards)))
+        return results
 
     def handle_pass(self, player: tornado.websocket.WebSocketHandler) -> Tuple[bool, str]:
         """处理玩家过牌"""
         success, message = self.pass_turn(player)
+        if success and self.record is not None:
+            self.game_log.add_pass(self.record, self.players.index(player))
         if success:
             # 广播游戏状态
             self.broadcast_game_state()
@@ -528,43 +816,68 @@ class GameRoom:
 
 class GameHandler(tornado.websocket.WebSocketHandler):
     rooms: Dict[str, GameRoom] = {}  # 所有游戏房间
+    lobby: Lobby = Lobby(rooms, MAX_PLAYERS)  # 开放房间索引和快速匹配队列
+    ledger: Optional[Ledger] = None  # 持久化积分账本，启动时设置
+    game_log: Optional[GameLog] = None  # 对局日志，启动时设置
+    player_id: Optional[str] = None  # 玩家身份（identify 之后才有），积分账本按它记录
     
     def check_origin(self, origin: str) -> bool:
         return True
         
     def open(self) -> None:
-        print("新玩家连接")
+        CONNECTIONS.inc()
+        logger.info("新玩家连接")
         
     def on_message(self, message: str) -> None:
-        print(f"收到消息: {message}")
+        logger.debug("收到消息: %s", message)
+        start = time.perf_counter()
+        action = None
         try:
             data = json.loads(message)
             action = data.get('action')
             
             if action == 'create_room':
                 deck_count = int(data.get('deck_count', 1))  # 确保转换为整数
-                room_id = str(random.randint(1000, 9999))
-                self.rooms[room_id] = GameRoom(deck_count)
-                self.write_message({'action': 'room_created', 'room_id': room_id})
-                print(f"创建房间成功: {room_id}")
+                try:
+                    # 玩法：预设名称或 {"base": 预设名, 规则项: 值}，不传为标准玩法
+                    rules = resolve_variant(data.get('variant'), deck_count)
+                except ValueError as e:
+                    self.write_message({'action': 'error', 'message': str(e)})
+                else:
+                    room_id = self.new_room(rules.deck_count, rules).room_id
+                    self.write_message({'action': 'room_created', 'room_id': room_id,
+                                        'rules': rules.spec.to_dict()})
+                    logger.info("创建房间成功: %s", room_id)
                 
             elif action == 'join_room':
                 room_id = data.get('room_id')
-                print(f"尝试加入房间: {room_id}")
+                logger.debug("尝试加入房间: %s", room_id)
                 if room_id in self.rooms:
                     room = self.rooms[room_id]
-                    if room.add_player(self):
+                    if self.player_id is not None and room.player_id_taken(self.player_id):
+                        self.write_message({'action': 'joined_room', 'success': False, 'message': '该身份已在房间中'})
+                    elif room.add_player(self):
+                        self.lobby.cancel(self)
+                        self.stop_spectating()  # 入座后不再同时收观战状态
                         self.current_room = room_id
-                        print(f"玩家成功加入房间 {room_id}, 当前玩家数: {len(room.players)}")
+                        logger.info("玩家成功加入房间 %s, 当前玩家数: %d", room_id, len(room.players))
                         self.write_message({'action': 'joined_room', 'success': True})
                         self.broadcast_room_state(room)
                     else:
-                        print(f"加入房间失败: 房间已满或游戏已开始")
+                        logger.info("加入房间失败: 房间已满或游戏已开始")
                         self.write_message({'action': 'joined_room', 'success': False, 'message': '房间已满或游戏已开始'})
                 else:
-                    print(f"加入房间失败: 房间 {room_id} 不存在")
+                    logger.info("加入房间失败: 房间 %s 不存在", room_id)
                     self.write_message({'action': 'joined_room', 'success': False, 'message': '房间不存在'})
                     
+            elif action == 'add_bot':
+                if hasattr(self, 'current_room'):
+                    room = self.rooms[self.current_room]
+                    if room.add_bot():
+                        self.broadcast_room_state(room)
+                    else:
+                        self.write_message({'action': 'error', 'message': '房间已满或游戏已开始'})
+                        
             elif action == 'start_game':
                 if hasattr(self, 'current_room'):
                     room = self.rooms[self.current_room]
@@ -576,21 +889,8 @@ class GameHandler(tornado.websocket.WebSocketHandler):
             elif action == 'play_cards':
                 if hasattr(self, 'current_room'):
                     room = self.rooms[self.current_room]
-                    success, message = room.play_cards(self, data.get('cards', []))
-                    if success:
-                        # 先检查游戏是否结束
-                        self.broadcast_game_state(room)
-                        game_over, winners = room.check_game_over()
-                        print(f"game_over: {game_over}, winners: {winners}")
-                        if game_over:
-                            # 先广播游戏结束消息
-                            self.broadcast_game_over(room, winners)
-                            # 然后再广播最终的游戏状态
-                            self.broadcast_game_state(room)
-                        else:
-                            # 如果游戏没有结束，只广播当前状态
-                            self.broadcast_game_state(room)
-                    else:
+                    success, message = room.handle_play(self, intern_cards(data.get('cards', [])))
+                    if not success:
                         self.write_message({'action': 'error', 'message': message})
                         
             elif action == 'pass':
@@ -602,6 +902,12 @@ class GameHandler(tornado.websocket.WebSocketHandler):
                     else:
                         self.write_message({'action': 'error', 'message': message})
                         
+            elif action == 'auto_arrange':
+                if hasattr(self, 'current_room'):
+                    room = self.rooms[self.current_room]
+                    if room.set_auto_arrange(self, bool(data.get('enabled', True))):
+                        self.broadcast_game_state(room)
+                        
             elif action == 'change_name':
                 if hasattr(self, 'current_room'):
                     room = self.rooms[self.current_room]
@@ -611,42 +917,144 @@ class GameHandler(tornado.websocket.WebSocketHandler):
                     else:
                         self.write_message({'action': 'error', 'message': '修改名称失败'})
                         
+            elif action == 'spectate':
+                room_id = data.get('room_id')
+                if hasattr(self, 'current_room') or hasattr(self, 'spectating'):
+                    self.write_message({'action': 'spectating', 'success': False, 'message': '已经在房间里了'})
+                elif room_id not in self.rooms:
+                    self.write_message({'action': 'spectating', 'success': False, 'message': '房间不存在'})
+                else:
+                    room = self.rooms[room_id]
+                    room.add_spectator(self)
+                    self.spectating = room_id
+                    self.write_message({'action': 'spectating', 'success': True, 'room_id': room_id})
+                    # 新观众先单独收到一份当前状态，之后随房间一起推送
+                    index = {p: i for i, p in enumerate(room.players)}
+                    self.write_message(room.spectator_state(index, room.public_state(index)))
+                    
+            elif action == 'unspectate':
+                success = self.stop_spectating()
+                self.write_message({'action': 'unspectated', 'success': success})
+                    
+            elif action == 'identify':
+                # 身份不做验证，客户端自报；只拒绝与同桌其他玩家重复的身份
+                player_id = str(data.get('player_id', '')).strip()[:64]
+                room = self.rooms.get(getattr(self, 'current_room', None))
+                if player_id and room is not None and room.player_id_taken(player_id, self):
+                    self.write_message({'action': 'identified', 'success': False, 'message': '该身份已在房间中'})
+                else:
+                    if player_id:
+                        self.player_id = player_id
+                    self.write_message({'action': 'identified', 'success': bool(player_id)})
+                
+            elif action == 'leaderboard':
+                limit = min(100, max(1, int(data.get('limit', 20))))
+                tornado.ioloop.IOLoop.current().spawn_callback(self.send_leaderboard, limit)
+                
+            elif action == 'history':
+                limit = min(100, max(1, int(data.get('limit', 20))))
+                player_id = data.get('player_id') or self.player_id
+                if player_id:
+                    tornado.ioloop.IOLoop.current().spawn_callback(self.send_history, str(player_id), limit)
+                else:
+                    self.write_message({'action': 'error', 'message': '请先表明身份'})
+                    
+            elif action == 'list_rooms':
+                deck_count = data.get('deck_count')
+                total, rooms = self.lobby.list_rooms(
+                    deck_count=int(deck_count) if deck_count is not None else None,
+                    min_free=max(1, int(data.get('min_free', 1))),
+                    offset=max(0, int(data.get('offset', 0))),
+                    limit=min(100, max(1, int(data.get('limit', 20)))))
+                self.write_message({'action': 'room_list', 'total': total, 'rooms': rooms})
+                
+            elif action == 'quick_match':
+                deck_count = int(data.get('deck_count', 1))
+                size = int(data.get('size', 4))
+                if hasattr(self, 'current_room'):
+                    self.write_message({'action': 'error', 'message': '已经在房间里了'})
+                elif deck_count not in (1, 2) or not 2 <= size <= MAX_PLAYERS:
+                    self.write_message({'action': 'error', 'message': '匹配参数不正确'})
+                else:
+                    group = self.lobby.enqueue(self, deck_count, size)
+                    if group is None:
+                        self.write_message({'action': 'match_queued', 'deck_count': deck_count, 'size': size,
+                                            'waiting': self.lobby.queue_length(deck_count, size)})
+                    else:
+                        self.start_matched_room(group, deck_count)
+                        
+            elif action == 'cancel_match':
+                self.write_message({'action': 'match_cancelled', 'success': self.lobby.cancel(self)})
+                
             elif action == 'throw_brick':
                 if hasattr(self, 'current_room'):
                     room = self.rooms[self.current_room]
                     from_player = data.get('from_player')
                     to_player = data.get('to_player')
-                    # 广播扔砖头事件给房间内所有玩家
-                    for player in room.players:
-                        player.write_message({
-                            'action': 'throw_brick',
-                            'from_player': from_player,
-                            'to_player': to_player
-                        })
+                    # 广播扔砖头事件给房间内所有玩家和观众
+                    room.broadcast_event({
+                        'action': 'throw_brick',
+                        'from_player': from_player,
+                        'to_player': to_player
+                    })
                         
             elif action == 'show_fire':
                 if hasattr(self, 'current_room'):
                     room = self.rooms[self.current_room]
                     player_index = data.get('player_index')
-                    # 广播火焰特效事件给房间内所有玩家
-                    for player in room.players:
-                        player.write_message({
-                            'action': 'show_fire',
-                            'player_index': player_index
-                        })
+                    # 广播火焰特效事件给房间内所有玩家和观众
+                    room.broadcast_event({
+                        'action': 'show_fire',
+                        'player_index': player_index
+                    })
                         
         except Exception as e:
             # print(f"处理消息出错: {e}")
             # self.write_message({'action': 'error', 'message': '服务器内部错误'})
             raise
+        finally:
+            ACTION_LATENCY.observe(time.perf_counter() - start, action if action in KNOWN_ACTIONS else 'unknown')
+            
+    def new_room(self, deck_count: int, rules: Optional[RuleTables] = None) -> GameRoom:
+        """创建房间并接入大厅索引和积分账本"""
+        room_id = self.lobby.new_room_id()
+        room = GameRoom(deck_count, room_id, rules)
+        room.listener = self.lobby.update
+        room.ledger = self.ledger
+        room.game_log = self.game_log
+        self.rooms[room_id] = room
+        return room
+        
+    def start_matched_room(self, group: List['GameHandler'], deck_count: int) -> None:
+        """快速匹配凑齐一桌：建房、全部入座并直接开局"""
+        room = self.new_room(deck_count)
+        room_id = room.room_id
+        for player in group:
+            room.add_player(player)
+            player.stop_spectating()
+            player.current_room = room_id
+            player.write_message({'action': 'joined_room', 'success': True, 'room_id': room_id})
+        logger.info("快速匹配成桌: %s, %d 人", room_id, len(group))
+        self.broadcast_room_state(room)
+        if room.start_game():
+            self.broadcast_game_state(room)
+            
+    async def send_leaderboard(self, limit: int) -> None:
+        players = await self.ledger.top_async(limit) if self.ledger is not None else []
+        if self.ws_connection is not None:
+            self.write_message({'action': 'leaderboard', 'players': players})
+            
+    async def send_history(self, player_id: str, limit: int) -> None:
+        games = await self.ledger.history_async(player_id, limit) if self.ledger is not None else []
+        if self.ws_connection is not None:
+            self.write_message({'action': 'history', 'player_id': player_id, 'games': games})
             
     def broadcast_room_state(self, room: GameRoom) -> None:
         """广播房间状态"""
-        for player in room.players:
-            player.write_message({
-                'action': 'room_state',
-                'player_count': len(room.players)
-            })
+        room.broadcast_event({
+            'action': 'room_state',
+            'player_count': len(room.players)
+        })
             
     def broadcast_game_state(self, room: GameRoom) -> None:
         """广播游戏状态"""
@@ -654,28 +1062,37 @@ class GameHandler(tornado.websocket.WebSocketHandler):
         
     def broadcast_game_over(self, room: GameRoom, winners: List[tornado.websocket.WebSocketHandler]) -> None:
         """广播游戏结束"""
-        loser = [p for p in room.players if p not in winners][0]
-        for player in room.players:
-            player.write_message({
-                'action': 'game_over',
-                'winners': [room.players.index(p) for p in winners],
-                'loser': room.players.index(loser),
-                'scores': {
-                    'winners': [(room.players.index(p), room.scores[p], len(room.players) - room.finished_order.index(p) - 1) for p in winners],
-                    'loser': (room.players.index(loser), room.scores[loser], -len(room.player_cards[loser]))
-                },
-                'player_names': {room.players.index(p): room.player_names[p] for p in room.players}
-            })
+        room.broadcast_game_over(winners)
+            
+    def stop_spectating(self) -> bool:
+        """离开正在观战的房间；没有在观战时返回 False"""
+        if not hasattr(self, 'spectating'):
+            return False
+        if self.spectating in self.rooms:
+            self.rooms[self.spectating].remove_spectator(self)
+        del self.spectating
+        return True
             
     def on_close(self) -> None:
+        CONNECTIONS.dec()
+        self.lobby.cancel(self)
+        self.stop_spectating()
         if hasattr(self, 'current_room'):
             room = self.rooms[self.current_room]
             room.remove_player(self)
-            if len(room.players) == 0:
+            if not room.has_humans():
+                room.close()
+                self.lobby.discard(self.current_room)
                 del self.rooms[self.current_room]
             else:
                 self.broadcast_room_state(room)
 
+REGISTRY.register(Gauge('silverpoker_rooms', '当前房间数', fn=lambda: len(GameHandler.rooms)))
+REGISTRY.register(Gauge('silverpoker_open_rooms', '大厅中可加入的房间数', fn=lambda: GameHandler.lobby.open_count()))
+REGISTRY.register(Gauge('silverpoker_match_waiting', '快速匹配排队中的玩家数', fn=lambda: GameHandler.lobby.waiting_count()))
+REGISTRY.register(Gauge('silverpoker_active_games', '正在进行的对局数',
+                        fn=lambda: sum(1 for room in GameHandler.rooms.values() if room.game_started)))
+
 class MainHandler(tornado.web.RequestHandler):
     def get(self) -> None:
         self.render("index.html")
@@ -689,8 +1106,36 @@ def make_app() -> tornado.web.Application:
     static_path="static"
     )
 
+def make_admin_app() -> tornado.web.Application:
+    """本机管理端口：指标与按需的 CPU / 内存分析"""
+    return make_metrics_app([
+        (r"/debug/profile", ProfileHandler),
+        (r"/debug/memory", MemoryHandler, dict(
+            classes=(GameRoom, GameHandler, BotPlayer),
+            rooms=lambda: GameHandler.rooms,
+            # 统计房间大小时不展开玩家连接、任务队列和其它房间
+            stop=lambda o: isinstance(o, (tornado.websocket.WebSocketHandler, BotPlayer, RoomExecutor, GameRoom)),
+        )),
+    ])
+
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get('SILVERPOKER_LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    GameHandler.ledger = Ledger(os.environ.get('SILVERPOKER_LEDGER_PATH', 'silverpoker.db'))
+    atexit.register(GameHandler.ledger.close)
+    GameHandler.game_log = GameLog(os.environ.get('SILVERPOKER_GAME_LOG_DIR', 'gamelogs'))
+    atexit.register(GameHandler.game_log.close)
+    # 在进程池创建之前映射规则快照，工作进程共用同一份；快照在部署时生成，启动时不重新生成
+    rules_snapshot.install(os.environ.get('SILVERPOKER_RULES_SNAPSHOT', rules_snapshot.DEFAULT_PATH), rebuild=False)
     app = make_app()
     app.listen(address='0.0.0.0', port=8888)
-    print("服务器启动在 http://localhost:8888")
+    # 指标和调试接口只在本机端口上提供
+    make_admin_app().listen(address='127.0.0.1', port=int(os.environ.get('SILVERPOKER_METRICS_PORT', 9108)))
+    install_signal_handlers()
+    lag_monitor = IOLoopLagMonitor()
+    lag_monitor.start()
+    REGISTRY.register(Gauge('silverpoker_ioloop_lag_seconds', '最近一次 IOLoop 延迟', fn=lambda: lag_monitor.last_lag))
+    REGISTRY.register(Gauge('silverpoker_ioloop_max_lag_seconds', 'IOLoop 最大延迟', fn=lambda: lag_monitor.max_lag))
+    REGISTRY.register(Gauge('silverpoker_ioloop_blocked_seconds', 'IOLoop 累计阻塞时间', fn=lambda: lag_monitor.total_lag))
+    logger.info("服务器启动在 http://localhost:8888")
     tornado.ioloop.IOLoop.current().start()
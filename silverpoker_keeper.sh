@@ -1 +1,2 @@
+./venv/bin/python3 rules_snapshot.py check > /dev/null || ./venv/bin/python3 rules_snapshot.py build
 ./venv/bin/python3 server.py
\ No newline at end of file
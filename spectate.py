@@ -0,0 +1,118 @@
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+import tornado.escape
+import tornado.ioloop
+import tornado.websocket
+
+from metrics import BROADCAST_BYTES, BROADCAST_FRAMES, REGISTRY, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+FANOUT_CHUNK = 200  # 每次 IOLoop 回调最多发给多少名观众，剩下的让出事件循环后再发
+SAMPLE_THRESHOLD = 200  # 观众超过这个数时降低状态推送频率；None 表示不降频
+SAMPLE_INTERVAL = 0.5  # 降频后两次状态推送的最小间隔（秒）
+
+SPECTATORS = REGISTRY.register(Gauge('silverpoker_spectators', '当前观战连接数'))
+FANOUT_SECONDS = REGISTRY.register(Histogram(
+    'silverpoker_spectator_fanout_seconds', '一批观战消息发送的耗时（每批最多 FANOUT_CHUNK 个连接）'))
+
+
+class Audience:
+    """一个房间的观众：公开状态只编码一次，在玩家的消息发完之后分批推送
+
+    publish() 只记下最新的状态，同一轮事件循环里的多次变化合并成一次推送；
+    event() 用于不能合并的事件（游戏结束、扔砖头等），按顺序在状态之前发出。
+    """
+
+    __slots__ = ('watchers', 'sample_threshold', 'sample_interval', '_state', '_events', '_scheduled',
+                 '_last_sent')
+
+    def __init__(self, sample_threshold: Optional[int] = SAMPLE_THRESHOLD,
+                 sample_interval: float = SAMPLE_INTERVAL) -> None:
+        self.watchers: Dict[Any, None] = {}  # 观众连接（按加入顺序）
+        self.sample_threshold = sample_threshold
+        self.sample_interval = sample_interval
+        self._state: Optional[Dict[str, Any]] = None  # 尚未推送的最新状态
+        self._events: List[Dict[str, Any]] = []  # 尚未推送的事件
+        self._scheduled: bool = False
+        self._last_sent: float = 0.0  # 上一次推送状态的时间
+
+    def __len__(self) -> int:
+        return len(self.watchers)
+
+    def add(self, watcher: Any) -> None:
+        if watcher not in self.watchers:
+            self.watchers[watcher] = None
+            SPECTATORS.inc()
+
+    def remove(self, watcher: Any) -> None:
+        if self.watchers.pop(watcher, 0) is None:
+            SPECTATORS.dec()
+
+    def close(self) -> None:
+        """房间关闭：通知所有观众并清空"""
+        for watcher in self.watchers:
+            try:
+                watcher.write_message({'action': 'room_closed'})
+            except tornado.websocket.WebSocketClosedError:
+                pass
+        self.clear()
+
+    def clear(self) -> None:
+        SPECTATORS.dec(len(self.watchers))
+        self.watchers.clear()
+        self._state = None
+        self._events.clear()
+
+    def publish(self, state: Dict[str, Any]) -> None:
+        """更新公开状态；旧的未推送状态直接被覆盖"""
+        if not self.watchers:
+            return
+        self._state = state
+        self._schedule()
+
+    def event(self, message: Dict[str, Any]) -> None:
+        if not self.watchers:
+            return
+        self._events.append(message)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._scheduled:
+            return
+        self._scheduled = True
+        delay = 0.0
+        if self.sample_threshold is not None and len(self.watchers) > self.sample_threshold:
+            delay = max(0.0, self._last_sent + self.sample_interval - time.monotonic())
+        # 不在调用者（玩家出牌）的调用栈里发送，避免观众数量影响玩家的响应
+        tornado.ioloop.IOLoop.current().call_later(delay, self._flush)
+
+    def _flush(self) -> None:
+        self._scheduled = False
+        messages = self._events
+        self._events = []
+        if self._state is not None:
+            messages.append(self._state)
+            self._state = None
+            self._last_sent = time.monotonic()
+        watchers = list(self.watchers)
+        for message in messages:
+            # 每条消息只编码一次，所有观众共用同一个 bytes 对象
+            data = tornado.escape.utf8(tornado.escape.json_encode(message))
+            BROADCAST_FRAMES.inc(len(watchers), message['action'])
+            BROADCAST_BYTES.inc(len(data) * len(watchers), message['action'])
+            self._send_chunk(data, watchers, 0)
+
+    def _send_chunk(self, data: bytes, watchers: List[Any], start: int) -> None:
+        began = time.perf_counter()
+        end = min(start + FANOUT_CHUNK, len(watchers))
+        for watcher in watchers[start:end]:
+            try:
+                watcher.write_message(data)
+            except tornado.websocket.WebSocketClosedError:
+                self.remove(watcher)
+        FANOUT_SECONDS.observe(time.perf_counter() - began)
+        if end < len(watchers):
+            tornado.ioloop.IOLoop.current().add_callback(self._send_chunk, data, watchers, end)